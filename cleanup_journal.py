@@ -0,0 +1,283 @@
+'''
+Copyright (c) 2013 by JustAMan at GitHub
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Helper module implementing append-only write-ahead journal of deletion operations, so that
+interrupted cleanup (reboot, Ctrl-C, closed console) can be resumed without rescanning and
+asking the user again.
+
+Journal is a plain text file, each line is a tab-separated record:
+    <operation> <scope> <key> <size>
+where scope is the name of cleanup stage (e.g. "patches" or "drivers") and key identifies an
+item in it (file path or oem###.inf name). Records are fsynced in batches, so after a crash
+some of the latest records may be lost; that's why unfinished items are always re-checked
+on resume instead of trusting the journal blindly. Journal that has no unfinished items left
+is stale and is started afresh when opened.
+
+Only per-scope totals are kept in memory, planned items are read back from the file when
+resuming, so huge plans don't have to fit into memory.
+'''
+
+import os
+import collections
+
+from spill import SpillSet, SpillList
+
+PLAN, START, DONE, FAIL, END, MODE = 'plan', 'start', 'done', 'fail', 'end', 'mode'
+TAIL_BLOCK = 64 * 1024
+
+class JournalItem(object):
+    '''
+    State of a single planned item as restored from the journal
+    '''
+    def __init__(self, key, size):
+        self.key = key
+        self.size = size
+        self.state = PLAN
+        self.reclaimed = 0
+
+    def __repr__(self):
+        return 'JournalItem(key=%s, size=%s, state=%s)' % (self.key, self.size, self.state)
+
+def _iterRecords(f):
+    '''
+    Yields (operation, scope, key, size) records of the journal file; the last record torn by
+    a crash (or being written right now by another process) is left out
+    '''
+    f.seek(0)
+    for line in f:
+        if not line.endswith('\n'):
+            break
+        try:
+            op, scope, key, size = line[:-1].split('\t')
+            size = int(size)
+        except ValueError:
+            continue
+        yield op, scope, key, size
+
+def _getIntactLength(f):
+    '''
+    Returns the length of the journal file without its torn last record
+    '''
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    while end:
+        start = max(0, end - TAIL_BLOCK)
+        f.seek(start)
+        newline = f.read(end - start).rfind('\n')
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+def readJournal(path):
+    '''
+    Reads the journal without changing it, so it's safe to use while cleanup is running.
+    Returns the list of (scope, JournalItem) pairs for all planned items.
+    '''
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return []
+    scopes = collections.defaultdict(collections.OrderedDict)
+    with f:
+        for op, scope, key, size in _iterRecords(f):
+            items = scopes[scope]
+            if op == PLAN:
+                items[key] = JournalItem(key, size)
+                continue
+            try:
+                item = items[key]
+            except KeyError:
+                continue
+            item.state = op
+            if op == DONE:
+                item.reclaimed = size
+    return [(scope, item) for scope, items in scopes.iteritems() for item in items.itervalues()]
+
+class DeletionJournal(object):
+    '''
+    Append-only journal of planned, started and completed deletions.
+    If memoryLimit is given, keys of completed items are spilled to disk when resuming.
+    '''
+    def __init__(self, path, syncEvery=32, memoryLimit=None):
+        self.path = path
+        self.syncEvery = syncEvery
+        self.memoryLimit = memoryLimit
+        self.__reclaimed = collections.defaultdict(int)
+        self.__finished = set()
+        self.__modes = {}
+        self.__unsynced = 0
+        self.__file = None
+        self.__load()
+        self.__file = open(self.path, 'ab')
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r+b') as f:
+            length = _getIntactLength(f)
+            if length < os.fstat(f.fileno()).st_size:
+                # last record was torn by a crash, cut it off so appended records stay intact
+                f.truncate(length)
+            for op, scope, key, size in _iterRecords(f):
+                if op == END:
+                    self.__finished.add(scope)
+                elif op == MODE:
+                    self.__modes[scope] = key
+                elif op == DONE:
+                    self.__reclaimed[scope] += size
+        if not self.hasUnfinished():
+            # there's nothing to resume: records left by a run interrupted between stages
+            # (e.g. at the prompt) are stale, so start afresh instead of skipping finished
+            # stages forever
+            self.__reclaimed.clear()
+            self.__finished.clear()
+            self.__modes.clear()
+            with open(self.path, 'r+b') as f:
+                f.truncate(0)
+
+    def __write(self, op, scope, key='', size=0, sync=False):
+        self.__file.write('%s\t%s\t%s\t%d\n' % (op, scope, key, size))
+        self.__unsynced += 1
+        if sync or self.__unsynced >= self.syncEvery:
+            self.sync()
+
+    def sync(self):
+        '''
+        Forces all written records to the disk
+        '''
+        if self.__unsynced:
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__unsynced = 0
+
+    def plan(self, scope, items, mode=None):
+        '''
+        Records the list of (key, size) pairs planned for deletion in given scope and the way
+        they are going to be removed (if it matters to the caller).
+        The plan is synced to disk before returning so it's safe to start deleting.
+        '''
+        if mode:
+            self.__modes[scope] = mode
+            self.__write(MODE, scope, mode)
+        for key, size in items:
+            self.__write(PLAN, scope, key, size)
+        self.sync()
+
+    def start(self, scope, key):
+        self.__write(START, scope, key)
+
+    def done(self, scope, key, reclaimed):
+        self.__reclaimed[scope] += reclaimed
+        self.__write(DONE, scope, key, reclaimed)
+
+    def failed(self, scope, key):
+        self.__write(FAIL, scope, key)
+
+    def finish(self, scope):
+        '''
+        Marks whole scope as finished, it would be skipped completely if the run is interrupted
+        and resumed later
+        '''
+        self.__finished.add(scope)
+        self.__write(END, scope, sync=True)
+
+    def isFinished(self, scope):
+        return scope in self.__finished
+
+    def getMode(self, scope):
+        '''
+        Returns the mode the scope was planned with or None
+        '''
+        return self.__modes.get(scope)
+
+    def __iterUnfinished(self, scope=None):
+        '''
+        Yields (scope, key, size) of items that were planned but not yet done or failed
+        '''
+        if self.__file is not None:
+            self.__file.flush()
+        completed = SpillSet(self.memoryLimit)
+        try:
+            with open(self.path, 'rb') as f:
+                for op, itemScope, key, size in _iterRecords(f):
+                    if op in (DONE, FAIL) and scope in (None, itemScope):
+                        completed.add('%s\t%s' % (itemScope, key))
+                for op, itemScope, key, size in _iterRecords(f):
+                    if op == PLAN and scope in (None, itemScope) and \
+                            '%s\t%s' % (itemScope, key) not in completed:
+                        yield itemScope, key, size
+        finally:
+            completed.close()
+
+    def hasUnfinished(self, scope=None):
+        '''
+        Checks if there are items planned but not yet done or failed in given scope (or in any)
+        '''
+        items = self.__iterUnfinished(scope)
+        try:
+            return next(items, None) is not None
+        finally:
+            items.close()
+
+    def resume(self, scope, isGone):
+        '''
+        Re-checks unfinished items of the scope using isGone(key) predicate: items that are
+        already gone (e.g. deleted just before the interruption) are marked done.
+        Returns the list of (key, size) pairs still to be processed.
+        '''
+        result = SpillList(self.memoryLimit)
+        for _, key, size in self.__iterUnfinished(scope):
+            if isGone(key):
+                self.done(scope, key, size)
+            else:
+                result.append((key, size))
+        self.sync()
+        return result
+
+    def reclaimed(self, scope=None):
+        '''
+        Returns cumulative number of bytes reclaimed in given scope (or in all scopes)
+        '''
+        if scope:
+            return self.__reclaimed.get(scope, 0)
+        return sum(self.__reclaimed.itervalues())
+
+    def close(self):
+        self.sync()
+        self.__file.close()
+
+    def discard(self):
+        '''
+        Closes and removes the journal, used when the whole cleanup is completed
+        '''
+        self.close()
+        os.remove(self.path)
+
+def getDefaultJournalPath(name):
+    '''
+    Returns default journal location for the cleanup script with given name
+    '''
+    return os.path.join(os.getenv('SystemRoot'), 'Temp', 'pyWinClobber_%s.journal' % name)
+
+if __name__ == '__main__':
+    import sys
+    sys.stderr.write('This is helper module not intended for standalone run\n')
+    sys.exit(1)
@@ -0,0 +1,218 @@
+'''
+Copyright (c) 2013 by JustAMan at GitHub
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Helper module that exports DriverStore packages into deduplicating archive before they are
+removed, so they can be restored later.
+
+Files are split into chunks using content-defined chunking (chunk boundaries depend on the
+data, not on offsets, so inserting some bytes into a file changes only the chunks around
+the insertion), each chunk is compressed and stored once under its SHA-256 digest. Successive
+versions of the same driver share most of their files and chunks, so keeping many of them
+costs little more than keeping one. Archive layout is:
+    chunks/ab/<digest>      zlib-compressed chunk data
+    files/ab/<digest>       list of chunk digests making up a file with given digest
+    manifests/<package>     JSON manifest of a package: driver info and list of its files
+'''
+
+import os
+import json
+import zlib
+import hashlib
+
+MIN_CHUNK = 16 * 1024
+MAX_CHUNK = 256 * 1024
+# Boundaries are looked for only at occurrences of the anchor byte, which are found by
+# bytearray.find() at C speed; checking every byte in Python is way too slow for big packages.
+# A boundary is an anchor whose preceding window hashes to zero under the mask. In driver
+# binaries (mostly uncompressed code) the anchor is about 0.15-0.3% of bytes, so every 64th
+# anchor gives average chunks of 45-70K with few forced cuts at MAX_CHUNK; compressed data
+# has more anchors (one per 256 bytes) and gets chunks of about 30K.
+CHUNK_ANCHOR = bytearray('\x5c')
+CHUNK_WINDOW = 32
+CHUNK_MASK = (1 << 6) - 1
+READ_BLOCK = 1024 * 1024
+
+class ArchiveError(Exception):
+    pass
+
+def _findBoundary(buf, end):
+    '''
+    Returns the end of the first chunk in buf[:end]
+    '''
+    # no boundaries are looked for inside first MIN_CHUNK bytes, this saves time
+    # and protects from too small chunks
+    pos = buf.find(CHUNK_ANCHOR, MIN_CHUNK, end)
+    while pos >= 0:
+        if not zlib.crc32(buffer(buf, pos - CHUNK_WINDOW, CHUNK_WINDOW + 1)) & CHUNK_MASK:
+            return pos + 1
+        pos = buf.find(CHUNK_ANCHOR, pos + 1, end)
+    return end
+
+def iterChunks(f):
+    '''
+    Splits file-like object into content-defined chunks, yields chunk data
+    '''
+    buf = bytearray()
+    eof = False
+    while True:
+        if not eof and len(buf) < MAX_CHUNK:
+            data = f.read(READ_BLOCK)
+            if data:
+                buf.extend(data)
+                continue
+            eof = True
+        if not buf:
+            return
+        end = min(len(buf), MAX_CHUNK)
+        cut = _findBoundary(buf, end) if end > MIN_CHUNK else end
+        yield bytes(buf[:cut])
+        del buf[:cut]
+
+def getFileDigest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(READ_BLOCK), ''):
+            digest.update(data)
+    return digest.hexdigest()
+
+def _writeAtomic(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmpPath = '%s.tmp' % path
+    with open(tmpPath, 'wb') as f:
+        f.write(data)
+    if os.path.exists(path):
+        # os.rename does not overwrite existing files on Windows
+        os.remove(path)
+    os.rename(tmpPath, path)
+
+class DriverArchive(object):
+    '''
+    Content-addressed storage of driver packages
+    '''
+    def __init__(self, root):
+        self.root = root
+
+    def __objectPath(self, kind, digest):
+        return os.path.join(self.root, kind, digest[:2], digest)
+
+    def __manifestPath(self, packageName):
+        return os.path.join(self.root, 'manifests', packageName)
+
+    def hasPackage(self, packageName):
+        return os.path.exists(self.__manifestPath(packageName))
+
+    def __storeFile(self, path):
+        '''
+        Stores the file returning (digest, size, number of newly stored bytes)
+        '''
+        digest = getFileDigest(path)
+        size = os.path.getsize(path)
+        fileIndex = self.__objectPath('files', digest)
+        if os.path.exists(fileIndex):
+            # exactly the same file was stored before, there's no need to chunk it again
+            return digest, size, 0
+        chunks, stored = [], 0
+        with open(path, 'rb') as f:
+            for chunk in iterChunks(f):
+                chunkDigest = hashlib.sha256(chunk).hexdigest()
+                chunkPath = self.__objectPath('chunks', chunkDigest)
+                if not os.path.exists(chunkPath):
+                    data = zlib.compress(chunk, 6)
+                    _writeAtomic(chunkPath, data)
+                    stored += len(data)
+                chunks.append(chunkDigest)
+        _writeAtomic(fileIndex, '\n'.join(chunks))
+        return digest, size, stored
+
+    def exportPackage(self, packageDir, info=None):
+        '''
+        Stores all files of DriverStore package directory, info is a dictionary of additional
+        information (e.g. oem name and driver description) to keep in the manifest.
+        Returns the number of bytes the archive grew by.
+        '''
+        packageName = os.path.basename(os.path.normpath(packageDir))
+        files, stored = [], 0
+        for root, dirs, fileNames in os.walk(packageDir):
+            for fileName in fileNames:
+                path = os.path.join(root, fileName)
+                digest, size, added = self.__storeFile(path)
+                files.append({'path': os.path.relpath(path, packageDir), 'size': size,
+                              'digest': digest})
+                stored += added
+        manifest = json.dumps({'package': packageName, 'info': info or {}, 'files': files},
+                              indent=1, sort_keys=True)
+        _writeAtomic(self.__manifestPath(packageName), manifest)
+        return stored + len(manifest)
+
+    def getManifest(self, packageName):
+        try:
+            with open(self.__manifestPath(packageName), 'rb') as f:
+                return json.load(f)
+        except IOError:
+            raise ArchiveError('Package "%s" is not found in archive %s' % (packageName,
+                                                                            self.root))
+
+    def getPackages(self):
+        '''
+        Returns manifests of all archived packages
+        '''
+        manifestDir = os.path.join(self.root, 'manifests')
+        if not os.path.isdir(manifestDir):
+            return []
+        return [self.getManifest(name) for name in sorted(os.listdir(manifestDir))
+                if not name.endswith('.tmp')]
+
+    def restorePackage(self, packageName, targetDir):
+        '''
+        Rebuilds archived package files in targetDir verifying their digests,
+        returns the path to restored package directory
+        '''
+        manifest = self.getManifest(packageName)
+        packageDir = os.path.join(targetDir, manifest['package'])
+        for entry in manifest['files']:
+            target = os.path.join(packageDir, entry['path'])
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            try:
+                with open(self.__objectPath('files', entry['digest']), 'rb') as f:
+                    chunks = f.read().split()
+            except IOError:
+                raise ArchiveError('Archive is missing file %s' % entry['digest'])
+            digest = hashlib.sha256()
+            with open(target, 'wb') as out:
+                for chunkDigest in chunks:
+                    try:
+                        with open(self.__objectPath('chunks', chunkDigest), 'rb') as f:
+                            chunk = zlib.decompress(f.read())
+                    except (IOError, zlib.error):
+                        raise ArchiveError('Archive chunk %s is missing or damaged' % \
+                                           chunkDigest)
+                    digest.update(chunk)
+                    out.write(chunk)
+            if digest.hexdigest() != entry['digest']:
+                raise ArchiveError('Restored file "%s" does not match its digest' % target)
+        return packageDir
+
+if __name__ == '__main__':
+    import sys
+    sys.stderr.write('This is helper module not intended for standalone run\n')
+    sys.exit(1)
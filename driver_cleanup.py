@@ -23,19 +23,32 @@ The operation should be safe as it utilizes MS pnputil.exe to do the job, and th
 in which the util is used forbids removing the driver that is currently used for installed
 devices.
 
+Superseded drivers can be exported to a deduplicating archive before deletion (--archive) and
+staged back later (--restore-archived).
+
 For more information see "pnputil.exe -?"
 '''
 
-from win32elevate import elevateAdminRights
 from common_helpers import MB
+from cleanup_journal import DeletionJournal, getDefaultJournalPath
+from driver_archive import DriverArchive, ArchiveError
+from driver_duplicates import collectPackageFiles, findDuplicateFiles, analyzeDuplicates
+from package_catalog import PackageCatalog
+from driver_versions import splitDateAndVersion, normalizeDrivers, DateFormatError
 import subprocess
 import re
 import os
 import glob
 import collections
-import datetime
+import operator
 import sys
 import errno
+import argparse
+import tempfile
+import multiprocessing
+import hashlib
+
+JOURNAL_SCOPE = 'drivers'
 
 class PnpUtilOutputError(Exception):
     pass
@@ -54,6 +67,8 @@ class DriverInfo(object):
         self.driverDate = None
         self.rawDriverDate = None
         self.driverVersion = ()
+        # (driverVersion, isDate, driverDate), set when the date is parsed
+        self.sortKey = None
         self.__nextParam = 0
 
     def parseLine(self, line):
@@ -67,13 +82,9 @@ class DriverInfo(object):
                                       'Tried reading the driver %s') % (line, self))
         else:
             self.__nextParam += 1
-        if self.driverDateAndVersion:
-            try:
-                date, version = self.driverDateAndVersion.split(None, 1)
-            except ValueError:
-                date, version = self.driverDateAndVersion, '1'
-            self.rawDriverDate = date
-            self.driverVersion = tuple(int(x) for x in re.findall(r'(\d+)', version))
+        if paramName == 'driverDateAndVersion' and self.driverDateAndVersion:
+            self.rawDriverDate, self.driverVersion = \
+                    splitDateAndVersion(self.driverDateAndVersion)
 
     def __repr__(self):
         return 'DriverInfo(name=%s, provider=%s, class=%s, version=%s, signed=%s)' % \
@@ -144,24 +155,10 @@ def getAllDrivers():
             lastDriver = DriverInfo()
         lastDriver.parseLine(line)
 
-    # now try to guess correct day/month order
-    for dateTemplate in ('%d/%m/%Y', '%m/%d/%Y'):
-        for driver in drivers:
-            if not re.search(r'\d+/\d+/\d+', driver.rawDriverDate):
-                # this is not a date at all...
-                driver.driverDate = driver.rawDriverDate
-            else:
-                try:
-                    driver.driverDate = datetime.datetime.strptime(driver.rawDriverDate,
-                                                                   dateTemplate)
-                except ValueError:
-                    break
-        else:
-            # we didn't encounter any errors while converting data, so we assume that
-            # this dateTemplate is the right one, so we stop searching for correct date template
-            break
-    else:
-        # we didn't find suitable date template, notify the user
+    # day/month order depends on the locale, so it's guessed from all dates at once
+    try:
+        normalizeDrivers(drivers)
+    except DateFormatError:
         raise PnpUtilOutputError('Cannot find suitable date format')
     return {driver.name: driver for driver in drivers}
 
@@ -184,27 +181,11 @@ def deleteDriver(name):
         print 'done'
         return True
 
-def getFolderSize(path):
-    '''
-    Calculates target path size (recursively if target is a directory)
-    '''
-    result = os.path.getsize(path)
-    if os.path.isdir(path):
-        for root, dirs, files in os.walk(path):
-            for node in files + dirs:
-                result += os.path.getsize(os.path.join(root, node))
-    return result
-
-def main():
+def findSupersededDrivers(drivers):
     '''
-    Main function for the script
+    Returns a dictionary that maps oem###.inf name of each superseded driver to the name of
+    the most recent driver superseding it
     '''
-    elevateAdminRights()
-
-    print 'Reading all OEM drivers...',
-    drivers = getAllDrivers()
-    print 'done'
-
     # Let's find possible duplicates. The tuple of driver class (e.g. Keyboard, Display, etc.),
     # driver provider (Microsoft, nVidia, etc.) and signed information (MS Compatibility, etc.)
     # is considered to be the key defining a driver for the device. All drivers that have this
@@ -218,18 +199,22 @@ def main():
         if len(driversList) <= 1:
             del duplicates[key]
         else:
-            driversList.sort(cmp=lambda d1, d2: cmp(d1.driverVersion, d2.driverVersion) or \
-                                                cmp(d1.driverDate, d2.driverDate),
-                             reverse=True)
+            driversList.sort(key=operator.attrgetter('sortKey'), reverse=True)
             for dupDriver in driversList[1:]:
                 oemDups[dupDriver.name] = driversList[0].name
+    return oemDups
 
-    # Now we read all %SystemRoot%\inf\oem*.inf files to make a map that will allow us by
-    # estimating the size of drivers stored in DriverStore to find out which oem drivers are
-    # the largest and what we should remove.
-    print 'Reading oem*.inf files...',
-    infFiles = os.path.join(os.getenv('SystemRoot'), 'inf', 'oem*.inf')
-    oemFiles = {}
+def getDriverRepo():
+    return os.path.join(os.getenv('SystemRoot'), 'system32', 'DriverStore', 'FileRepository')
+
+def readOemInfFiles(infDir=None):
+    '''
+    Reads all %SystemRoot%\inf\oem*.inf files (or oem*.inf files in infDir if given).
+    Returns a dictionary that maps digest of .inf content to oem###.inf name and a dictionary
+    that maps oem###.inf name to the list of other oem names having exactly the same content.
+    '''
+    infFiles = os.path.join(infDir or os.path.join(os.getenv('SystemRoot'), 'inf'), 'oem*.inf')
+    oemFiles, oemAliases = {}, collections.defaultdict(list)
     for infName in glob.glob(infFiles):
         try:
             with open(infName, 'rb') as f:
@@ -238,46 +223,244 @@ def main():
             print 'Warning! Cannot read "%s" file: %s' % (infName, err)
             continue
         infName = os.path.basename(infName)
+        # keep only digests of the content, whole .inf files can take a lot of memory
+        content = hashlib.sha1(content).digest()
         try:
-            oemFiles[content]
+            oemName = oemFiles[content]
         except KeyError:
             oemFiles[content] = infName
         else:
             # There're two or more exact copies of .inf file with different names, that's really
             # strange. My guess here was that something is wrong with Windows installation,
             # so I used to stop script execution, but for now I've decided to ignore such
-            # drivers completely
-            continue
-    print 'done'
+            # drivers completely (only remembering them for duplicates report)
+            oemAliases[oemName].append(infName)
+    return oemFiles, oemAliases
 
-    # now parse %SystemRoot%\system32\DriverStore\FileRepository
-    print 'Parsing DriverStore...',
-    driverRepo = os.path.join(os.getenv('SystemRoot'), 'system32', 'DriverStore',
-                              'FileRepository')
-    driverSize = []
+def getPackageOem(oemFiles, driverRepo, driverDir):
+    '''
+    Returns oem###.inf name of single DriverStore package or None if it's not OEM
+    '''
+    # All folders should in here should have the same pattern - abc.inf_something where
+    # abc.inf lies within and should match to some oem###.inf file if this driver
+    # is OEM (not built in current Windows setup).
+    match = re.match(r'^(.*?\.inf)_.*$', driverDir)
+    if not match:
+        # this folder does not match desired pattern, ignore it
+        return None
+    infName = match.group(1)
+    try:
+        with open(os.path.join(driverRepo, driverDir, infName), 'rb') as f:
+            content = f.read()
+    except IOError, err:
+        if err.errno != errno.ENOENT:
+            raise
+        # file is missing, skip it
+        return None
+    # None if this infName is not OEM
+    return oemFiles.get(hashlib.sha1(content).digest())
+
+def getOemPackages(oemFiles, driverRepo=None):
+    '''
+    Parses %SystemRoot%\system32\DriverStore\FileRepository (or driverRepo if given),
+    returns a dictionary that maps oem###.inf name to the directory of its package
+    '''
+    driverRepo = driverRepo or getDriverRepo()
+    result = {}
     for driverDir in os.walk(driverRepo).next()[1]:
-        # All folders should in here should have the same pattern - abc.inf_something where
-        # abc.inf lies within and should match to some oem###.inf file read above if this driver
-        # is OEM (not built in current Windows setup).
-        try:
-            infName = re.match(r'^(.*?\.inf)_.*$', driverDir).group(1)
-        except ValueError:
-            # this folder does not match desired pattern, ignore it
+        oemName = getPackageOem(oemFiles, driverRepo, driverDir)
+        if oemName:
+            result[oemName] = os.path.join(driverRepo, driverDir)
+    return result
+
+def reportContentDuplicates(drivers, workers, catalog=None):
+    '''
+    Finds byte-identical files across all DriverStore packages and reports packages that are
+    fully or partially duplicated by other ones
+    '''
+    print 'Reading oem*.inf files...',
+    oemFiles, oemAliases = readOemInfFiles()
+    print 'done'
+    packageNames = dict((os.path.basename(driverDir), oemName)
+                        for oemName, driverDir in getOemPackages(oemFiles).iteritems())
+    def describe(package):
+        oemName = packageNames.get(package)
+        return '%s (%s)' % (package, drivers[oemName] if oemName in drivers else 'not OEM')
+
+    print 'Listing DriverStore files...',
+    packageFiles = collectPackageFiles(getDriverRepo())
+    print 'done'
+    print 'Comparing files content...',
+    groups, presumed = findDuplicateFiles(packageFiles, workers, catalog)
+    print 'done'
+
+    stats, wasted = analyzeDuplicates(packageFiles, groups, presumed)
+    for title, full in (('Fully duplicated packages:', True),
+                        ('Partially duplicated packages:', False)):
+        selected = [item for item in stats if item.isFull() == full]
+        if not selected:
             continue
-        try:
-            with open(os.path.join(driverRepo, driverDir, infName), 'rb') as f:
-                content = f.read()
-        except IOError, err:
-            if err.errno != errno.ENOENT:
-                raise
-            # file is missing, skip it
+        print title
+        for item in selected:
+            details = []
+            if item.duplicatedSize:
+                details.append('%s of %s duplicated, shares files with: %s' % \
+                               (MB(item.duplicatedSize), MB(item.size),
+                                ', '.join(sorted(item.sharedWith))))
+            if item.presumedSize:
+                details.append('[presumed] %s of %s known to the catalog, may be the same as '
+                               'files of: %s' % (MB(item.presumedSize), MB(item.size),
+                                                 ', '.join(sorted(item.presumedWith))))
+            print '%s: %s' % (describe(item.package), '; '.join(details))
+    for oemName, aliases in sorted(oemAliases.iteritems()):
+        print '%s has the same .inf content as %s' % (oemName, ', '.join(aliases))
+    print 'Duplicate files waste %s in total' % MB(wasted)
+    if presumed:
+        presumedSize = sum(group[0].size * (len(group) - 1) for group in presumed)
+        print '%d more groups of files (%s) are presumed identical by the catalog, but were ' \
+              'not compared (marked [presumed] above)' % (len(presumed), MB(presumedSize))
+
+def getFolderSize(path):
+    '''
+    Calculates target path size (recursively if target is a directory)
+    '''
+    result = os.path.getsize(path)
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            for node in files + dirs:
+                result += os.path.getsize(os.path.join(root, node))
+    return result
+
+def deleteDrivers(dups, journal):
+    '''
+    Deletes given (oemName, size) drivers recording the progress in the journal
+    '''
+    for dup, size in dups:
+        journal.start(JOURNAL_SCOPE, dup)
+        if deleteDriver(dup):
+            journal.done(JOURNAL_SCOPE, dup, size)
+        else:
+            journal.failed(JOURNAL_SCOPE, dup)
+    journal.finish(JOURNAL_SCOPE)
+
+def archiveDrivers(archive, dups, driverDirs, drivers):
+    '''
+    Exports given (oemName, size) drivers to the archive so they can be restored after deletion
+    '''
+    added = 0
+    for dup, size in dups:
+        packageDir = driverDirs[dup]
+        if archive.hasPackage(os.path.basename(packageDir)):
             continue
+        print 'Archiving %s...' % dup,
+        added += archive.exportPackage(packageDir, {'oemName': dup, 'driver': str(drivers[dup])})
+        print 'done'
+    print 'Archive grew by %s' % MB(added)
+
+def manageArchive(archive, args):
+    '''
+    Lists or restores archived driver packages as requested by command line
+    '''
+    if args.list_archive:
+        for manifest in archive.getPackages():
+            print '%s: %s (was %s), %s' % (manifest['package'], manifest['info'].get('driver'),
+                                           manifest['info'].get('oemName'),
+                                           MB(sum(entry['size'] for entry in manifest['files'])))
+    if args.restore_archived:
+        targetDir = args.restore_to or tempfile.mkdtemp(prefix='pyWinClobber_')
+        print 'Restoring %s to %s...' % (args.restore_archived, targetDir),
         try:
-            oemName = oemFiles[content]
-        except KeyError:
-            # this infName is not OEM, skipping
-            continue
-        driverSize.append((oemName, getFolderSize(os.path.join(driverRepo, driverDir))))
+            packageDir = archive.restorePackage(args.restore_archived, targetDir)
+        except ArchiveError as err:
+            print 'fail'
+            sys.exit(str(err))
+        print 'done'
+        infName = re.match(r'^(.*?\.inf)_.*$', os.path.basename(packageDir)).group(1)
+        print 'Staging %s back to DriverStore...' % infName,
+        try:
+            executePnputil(['-a', os.path.join(packageDir, infName)])
+        except subprocess.CalledProcessError, err:
+            print 'fail: unexpected pnputil return code = %s' % err.returncode
+        else:
+            print 'done'
+
+def main():
+    '''
+    Main function for the script
+    '''
+    # imported here as the rest of this module is also used for offline images analysis
+    # which may run on non-Windows host
+    from win32elevate import elevateAdminRights
+    elevateAdminRights()
+
+    parser = argparse.ArgumentParser(description='Removes superseded drivers from DriverStore')
+    parser.add_argument('--journal', default=getDefaultJournalPath('driver_cleanup'),
+                        help='path to the journal used to resume interrupted cleanup '
+                             '(default: %(default)s)')
+    parser.add_argument('--find-duplicates', action='store_true',
+                        help='report packages having byte-identical files and exit')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes used to compare files (default: number of '
+                             'CPUs)')
+    parser.add_argument('--catalog', metavar='FILE',
+                        help='catalog of known package files: when looking for duplicates they '
+                             'are not read completely and are reported separately as presumed '
+                             'duplicates')
+    parser.add_argument('--archive', metavar='DIR',
+                        help='export drivers to deduplicating archive in DIR before deleting')
+    parser.add_argument('--list-archive', action='store_true',
+                        help='list packages stored in the archive and exit')
+    parser.add_argument('--restore-archived', metavar='PACKAGE',
+                        help='restore archived package and stage it to DriverStore again')
+    parser.add_argument('--restore-to', metavar='DIR',
+                        help='where to put restored package files (default: temporary dir)')
+    args = parser.parse_args()
+
+    if args.find_duplicates:
+        print 'Reading all OEM drivers...',
+        drivers = getAllDrivers()
+        print 'done'
+        catalog = PackageCatalog(args.catalog) if args.catalog else None
+        reportContentDuplicates(drivers, args.workers, catalog)
+        return
+
+    archive = DriverArchive(args.archive) if args.archive else None
+    if args.list_archive or args.restore_archived:
+        if not archive:
+            parser.error('--archive is required to list or restore archived packages')
+        manageArchive(archive, args)
+        return
+
+    journal = DeletionJournal(args.journal)
+
+    print 'Reading all OEM drivers...',
+    drivers = getAllDrivers()
+    print 'done'
+
+    if journal.hasUnfinished(JOURNAL_SCOPE):
+        # previous run was interrupted while deleting drivers the user agreed to delete,
+        # so continue with the rest of them without rescanning DriverStore
+        dups = journal.resume(JOURNAL_SCOPE, lambda name: name not in drivers)
+        print 'Resuming interrupted cleanup (%d drivers left, %s reclaimed so far)' % \
+                (len(dups), MB(journal.reclaimed()))
+        deleteDrivers(dups, journal)
+        print 'Total reclaimed: %s' % MB(journal.reclaimed())
+        journal.discard()
+        return
+
+    oemDups = findSupersededDrivers(drivers)
+
+    # Now we read all %SystemRoot%\inf\oem*.inf files to make a map that will allow us by
+    # estimating the size of drivers stored in DriverStore to find out which oem drivers are
+    # the largest and what we should remove.
+    print 'Reading oem*.inf files...',
+    oemFiles = readOemInfFiles()[0]
+    print 'done'
+
+    print 'Parsing DriverStore...',
+    driverDirs = getOemPackages(oemFiles)
+    driverSize = [(oemName, getFolderSize(driverDir))
+                  for oemName, driverDir in driverDirs.iteritems()]
     print 'done'
 
     print 'Drivers (sorted by size):'
@@ -293,14 +476,17 @@ def main():
     if dups:
         answer = raw_input(('Possible obsolete drivers found (taking %s). Try to delete? ' + \
                            '[y(es)/n(o)] ') % (MB(dupSize))).lower()
-        cleanedSize = 0
         if answer in ('y', 'yes'):
-            for dup, size in dups:
-                if deleteDriver(dup):
-                    cleanedSize += size
-            print 'Was able to clean up %s out of %s expected' % (MB(cleanedSize), MB(dupSize))
+            if archive:
+                archiveDrivers(archive, dups, driverDirs, drivers)
+            journal.plan(JOURNAL_SCOPE, dups)
+            deleteDrivers(dups, journal)
+            print 'Was able to clean up %s out of %s expected' % (MB(journal.reclaimed()),
+                                                                  MB(dupSize))
         else:
             print 'Cancelled by user'
+    journal.discard()
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,197 @@
+'''
+Copyright (c) 2013 by JustAMan at GitHub
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Helper module that finds byte-identical files across DriverStore packages, so redundancy
+that is not visible from pnputil metadata can be found.
+
+Files are compared in stages, each stage only looks at candidates left from the previous one:
+files are grouped by size first, then by digest of their first block and only then by digest
+of the whole file. Most of the files have unique size, so only small part of DriverStore
+is ever read completely.
+'''
+
+import os
+import mmap
+import hashlib
+import collections
+import multiprocessing
+
+HEAD_SIZE = 4096
+# hash big files by pieces so they won't exhaust address space of 32-bit process
+MAP_WINDOW = 64 * 1024 * 1024
+
+class PackageFile(object):
+    '''
+    Single file of a DriverStore package
+    '''
+    __slots__ = ('package', 'path', 'size')
+    def __init__(self, package, path, size):
+        self.package = package
+        self.path = path
+        self.size = size
+
+def hashHead(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(HEAD_SIZE)).hexdigest()
+
+def hashFull(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        for offset in xrange(0, size, MAP_WINDOW):
+            view = mmap.mmap(f.fileno(), min(MAP_WINDOW, size - offset), offset=offset,
+                             access=mmap.ACCESS_READ)
+            try:
+                digest.update(view)
+            finally:
+                view.close()
+    return digest.hexdigest()
+
+def _safeHash(args):
+    # this runs in worker processes, so errors are returned instead of being raised
+    hashFunc, path = args
+    try:
+        return hashFunc(path)
+    except (IOError, OSError, ValueError):
+        return None
+
+def collectPackageFiles(driverRepo):
+    '''
+    Lists all non-empty files of all packages in DriverStore\\FileRepository
+    '''
+    result = []
+    for package in os.listdir(driverRepo):
+        packageDir = os.path.join(driverRepo, package)
+        if not os.path.isdir(packageDir):
+            continue
+        for root, dirs, files in os.walk(packageDir):
+            for fileName in files:
+                path = os.path.join(root, fileName)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                if size:
+                    result.append(PackageFile(package, path, size))
+    return result
+
+def _refineGroups(groups, hashFunc, pool):
+    '''
+    Splits each group of files further by the result of hashFunc, drops unique files.
+    Returns a dictionary that maps (size, digest) to the group of files.
+    '''
+    candidates = [entry for group in groups for entry in group]
+    digests = pool.map(_safeHash, [(hashFunc, entry.path) for entry in candidates],
+                       chunksize=16)
+    result = collections.defaultdict(list)
+    for entry, digest in zip(candidates, digests):
+        if digest is not None:
+            result[(entry.size, digest)].append(entry)
+    return dict((key, group) for key, group in result.iteritems() if len(group) > 1)
+
+def findDuplicateFiles(packageFiles, workers=None, catalog=None):
+    '''
+    Returns (list of groups of byte-identical files, list of groups presumed identical).
+    If package catalog is given, files whose size and first block are known to it are not
+    read completely when they belong to at most two packages. The catalog cannot prove that
+    they match each other, so such groups are only presumed identical and returned separately.
+    '''
+    bySize = collections.defaultdict(list)
+    for entry in packageFiles:
+        bySize[entry.size].append(entry)
+    groups = [group for group in bySize.itervalues() if len(group) > 1]
+    if not groups:
+        return [], []
+    pool = multiprocessing.Pool(workers)
+    try:
+        heads = _refineGroups(groups, hashHead, pool)
+        result, presumed, candidates = [], [], []
+        for (size, digest), group in heads.iteritems():
+            if size <= HEAD_SIZE:
+                # small files were read completely while hashing the first block
+                result.append(group)
+            elif catalog and len(set(entry.package for entry in group)) <= 2 and \
+                    catalog.lookup(size, digest):
+                # bigger groups are compared anyway, so that real duplicates in them are not
+                # mixed with files that only look the same
+                presumed.append(group)
+            else:
+                candidates.append(group)
+        result.extend(_refineGroups(candidates, hashFull, pool).itervalues())
+    finally:
+        pool.close()
+        pool.join()
+    return result, presumed
+
+class PackageDuplication(object):
+    '''
+    Duplication statistics of a single package
+    '''
+    def __init__(self, package):
+        self.package = package
+        self.size = 0
+        self.duplicatedSize = 0
+        self.sharedWith = set()
+        # the same for files that are only presumed identical by the catalog
+        self.presumedSize = 0
+        self.presumedWith = set()
+
+    def isFull(self):
+        return self.duplicatedSize == self.size
+
+def analyzeDuplicates(packageFiles, groups, presumed=()):
+    '''
+    Returns (list of PackageDuplication for packages having duplicated files, wasted bytes).
+    Wasted bytes is the total size of all extra copies of every duplicated file, groups that
+    are only presumed identical are not counted there.
+    '''
+    packages = {}
+    for entry in packageFiles:
+        try:
+            packages[entry.package].size += entry.size
+        except KeyError:
+            packages[entry.package] = PackageDuplication(entry.package)
+            packages[entry.package].size = entry.size
+    wasted = 0
+    for group in groups:
+        wasted += group[0].size * (len(group) - 1)
+    for kind, kindGroups in (('duplicated', groups), ('presumed', presumed)):
+        for group in kindGroups:
+            owners = set(entry.package for entry in group)
+            if len(owners) == 1:
+                # copies inside a single package waste space too, but do not make it a duplicate
+                continue
+            for entry in group:
+                stats = packages[entry.package]
+                if kind == 'duplicated':
+                    stats.duplicatedSize += entry.size
+                    stats.sharedWith.update(owners - set([entry.package]))
+                else:
+                    stats.presumedSize += entry.size
+                    stats.presumedWith.update(owners - set([entry.package]))
+    result = [stats for stats in packages.itervalues()
+              if stats.duplicatedSize or stats.presumedSize]
+    result.sort(key=lambda stats: (stats.duplicatedSize, stats.presumedSize), reverse=True)
+    return result, wasted
+
+if __name__ == '__main__':
+    import sys
+    sys.stderr.write('This is helper module not intended for standalone run\n')
+    sys.exit(1)
@@ -0,0 +1,140 @@
+'''
+Copyright (c) 2013 by JustAMan at GitHub
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Helper module that normalizes driver dates and versions as printed by pnputil.exe.
+
+pnputil prints dates in the format of current locale, so the order of day and month is
+guessed by looking at ranges of the fields of all dates at once: e.g. a field bigger than 12
+cannot be a month. Many drivers share the same date and version strings, so parsed values are
+memoized.
+'''
+
+import re
+import datetime
+
+DAY_FIRST, MONTH_FIRST, YEAR_FIRST = 'dmy', 'mdy', 'ymd'
+# when dates don't tell the order (all fields are 12 or less) day first is assumed
+ORDER_PREFERENCE = (DAY_FIRST, MONTH_FIRST, YEAR_FIRST)
+
+_fieldsCache = {}
+_dateCache = {}
+_versionCache = {}
+
+class DateFormatError(ValueError):
+    pass
+
+def splitDateAndVersion(dateAndVersion):
+    '''
+    Splits pnputil "date version" string into raw date string and version tuple
+    '''
+    try:
+        return _versionCache[dateAndVersion]
+    except KeyError:
+        pass
+    try:
+        date, version = dateAndVersion.split(None, 1)
+    except ValueError:
+        date, version = dateAndVersion, '1'
+    result = _versionCache[dateAndVersion] = \
+            (date, tuple(int(x) for x in re.findall(r'(\d+)', version)))
+    return result
+
+def _getFields(rawDate):
+    try:
+        return _fieldsCache[rawDate]
+    except KeyError:
+        pass
+    match = re.match(r'^(\d+)([/.-])(\d+)\2(\d+)$', rawDate)
+    result = _fieldsCache[rawDate] = \
+            tuple(int(match.group(i)) for i in (1, 3, 4)) if match else None
+    return result
+
+def _makeDate(fields, order):
+    '''
+    Returns datetime for date fields in given order or None if they don't make a valid date
+    '''
+    if order == DAY_FIRST:
+        day, month, year = fields
+    elif order == MONTH_FIRST:
+        month, day, year = fields
+    else:
+        year, month, day = fields
+    try:
+        return datetime.datetime(year, month, day)
+    except ValueError:
+        return None
+
+def inferDateOrder(rawDates):
+    '''
+    Finds the order of date fields that makes valid dates of all given strings in a single
+    pass over them. Strings that don't look like dates at all are ignored.
+    '''
+    possible = set(ORDER_PREFERENCE)
+    for fields in set(_getFields(rawDate) for rawDate in set(rawDates)):
+        if fields is None:
+            continue
+        for order in list(possible):
+            if _makeDate(fields, order) is None:
+                possible.discard(order)
+        if not possible:
+            raise DateFormatError('Cannot find suitable date format')
+    for order in ORDER_PREFERENCE:
+        if order in possible:
+            return order
+
+def parseDate(rawDate, order):
+    '''
+    Returns datetime for the date string or the string itself if it's not a date at all
+    '''
+    try:
+        return _dateCache[(rawDate, order)]
+    except KeyError:
+        pass
+    fields = _getFields(rawDate)
+    result = rawDate
+    if fields is not None:
+        result = _makeDate(fields, order)
+        if result is None:
+            raise DateFormatError('Date "%s" does not match %s format' % (rawDate, order))
+    _dateCache[(rawDate, order)] = result
+    return result
+
+def makeSortKey(driverVersion, driverDate):
+    '''
+    Returns the key to sort drivers by version and then by date; dates that could not be
+    parsed go before real ones, so strings and datetimes are never compared
+    '''
+    if isinstance(driverDate, datetime.datetime):
+        return (driverVersion, 1, driverDate)
+    return (driverVersion, 0, driverDate)
+
+def normalizeDrivers(drivers):
+    '''
+    Parses dates of all DriverInfo objects and sets their driverDate and sortKey
+    '''
+    order = inferDateOrder(driver.rawDriverDate for driver in drivers)
+    for driver in drivers:
+        driver.driverDate = parseDate(driver.rawDriverDate, order)
+        driver.sortKey = makeSortKey(driver.driverVersion, driver.driverDate)
+
+if __name__ == '__main__':
+    import sys
+    sys.stderr.write('This is helper module not intended for standalone run\n')
+    sys.exit(1)
@@ -0,0 +1,343 @@
+'''
+Copyright (c) 2013 by JustAMan at GitHub
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+This script gathers cleanup data from many machines. It has two modes:
+    fleet.py collector --db results.sqlite [--port 8766]
+        accepts connections from many agents at once and stores received records into
+        indexed SQLite database
+    fleet.py agent --collector host:port
+        runs driver and MSI cache scans (nothing is deleted) and streams the results to the
+        collector over single connection
+
+Records are sent in batches, each batch is a frame of zlib-compressed JSON prefixed by its
+length; collector acknowledges every batch after it is committed to the database.
+Collector does not use any Windows API, so it can run on any host.
+'''
+
+import os
+import sys
+import json
+import zlib
+import time
+import Queue
+import socket
+import struct
+import sqlite3
+import argparse
+import threading
+import SocketServer
+
+from package_catalog import PackageCatalog
+
+PROTOCOL_VERSION = 1
+DEFAULT_PORT = 8766
+MAX_FRAME = 64 * 1024 * 1024
+# limit of decompressed frame, so small frames cannot blow up into gigabytes
+MAX_MESSAGE = 64 * 1024 * 1024
+FRAME_HEADER = struct.Struct('!I')
+
+class FleetProtocolError(Exception):
+    pass
+
+def _recvExactly(sock, size):
+    chunks = []
+    while size:
+        data = sock.recv(min(size, 65536))
+        if not data:
+            return None
+        chunks.append(data)
+        size -= len(data)
+    return ''.join(chunks)
+
+def sendFrame(sock, message):
+    data = zlib.compress(json.dumps(message, separators=(',', ':')))
+    sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+def recvFrame(sock):
+    '''
+    Receives single message, returns None if connection was closed
+    '''
+    header = _recvExactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    size, = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME:
+        raise FleetProtocolError('Frame of %d bytes is too big' % size)
+    data = _recvExactly(sock, size)
+    if data is None:
+        raise FleetProtocolError('Connection closed in the middle of a frame')
+    try:
+        decompressor = zlib.decompressobj()
+        message = decompressor.decompress(data, MAX_MESSAGE)
+        if decompressor.unconsumed_tail:
+            raise FleetProtocolError('Frame decompresses to more than %d bytes' % MAX_MESSAGE)
+        return json.loads(message)
+    except (zlib.error, ValueError), err:
+        raise FleetProtocolError('Cannot decode frame: %s' % err)
+
+class RecordStore(object):
+    '''
+    SQLite database of records received from agents
+    '''
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS scans (id INTEGER PRIMARY KEY, host TEXT, started REAL, '
+            'received REAL)',
+        'CREATE TABLE IF NOT EXISTS records (scan INTEGER, host TEXT, type TEXT, key TEXT, '
+            'size INTEGER, data TEXT)',
+        'CREATE INDEX IF NOT EXISTS scans_host ON scans (host, started)',
+        'CREATE INDEX IF NOT EXISTS records_scan ON records (scan, type)',
+        'CREATE INDEX IF NOT EXISTS records_host ON records (host, type)',
+        'CREATE INDEX IF NOT EXISTS records_key ON records (type, key)',
+    )
+
+    def __init__(self, path):
+        # connection is used only by the writer thread that creates it, see Collector
+        self.path = path
+        self.__db = None
+
+    def open(self):
+        self.__db = sqlite3.connect(self.path)
+        for statement in self.SCHEMA:
+            self.__db.execute(statement)
+        self.__db.commit()
+
+    def addScan(self, host, started):
+        cursor = self.__db.execute('INSERT INTO scans (host, started, received) '
+                                   'VALUES (?, ?, ?)', (host, started, time.time()))
+        self.__db.commit()
+        return cursor.lastrowid
+
+    def addRecords(self, scanId, host, records):
+        self.__db.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)',
+                              [(scanId, host, record.get('type'), record.get('key'),
+                                record.get('size'), json.dumps(record))
+                               for record in records])
+        self.__db.commit()
+
+    def close(self):
+        self.__db.close()
+
+class CollectorHandler(SocketServer.BaseRequestHandler):
+    '''
+    Handles single agent connection
+    '''
+    def handle(self):
+        try:
+            hello = recvFrame(self.request)
+            if not hello or hello.get('version') != PROTOCOL_VERSION:
+                raise FleetProtocolError('Unexpected hello message: %r' % (hello, ))
+            host = hello.get('host') or self.client_address[0]
+            scanId = self.server.write(self.server.store.addScan, host, hello.get('started'))
+            while True:
+                message = recvFrame(self.request)
+                if message is None:
+                    break
+                self.server.write(self.server.store.addRecords, scanId, host,
+                                  message['records'])
+                sendFrame(self.request, {'ack': message['batch']})
+        except (FleetProtocolError, KeyError, socket.error), err:
+            sys.stderr.write('Agent %s:%s failed: %s\n' % (self.client_address + (err, )))
+
+class Collector(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    '''
+    Accepts many agents at once, every connection is handled by its own thread, while all
+    database writes are done by single writer thread in the order they were received
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, store):
+        SocketServer.TCPServer.__init__(self, address, CollectorHandler)
+        self.store = store
+        self.__queue = Queue.Queue()
+        self.__writer = threading.Thread(target=self.__writeLoop)
+        self.__writer.daemon = True
+        self.__writer.start()
+
+    def __writeLoop(self):
+        self.store.open()
+        while True:
+            task = self.__queue.get()
+            if task is None:
+                break
+            func, args, result = task
+            try:
+                result.append(func(*args))
+            except Exception, err: #pylint: disable=W0703
+                result.append(err)
+            result.done.set()
+        self.store.close()
+
+    def write(self, func, *args):
+        '''
+        Runs func in writer thread and waits for its result
+        '''
+        result = _WriteResult()
+        self.__queue.put((func, args, result))
+        result.done.wait()
+        if isinstance(result[0], Exception):
+            raise FleetProtocolError('Cannot store records: %s' % result[0])
+        return result[0]
+
+    def server_close(self):
+        SocketServer.TCPServer.server_close(self)
+        self.__queue.put(None)
+        self.__writer.join()
+
+class _WriteResult(list):
+    def __init__(self):
+        list.__init__(self)
+        self.done = threading.Event()
+
+class AgentConnection(object):
+    '''
+    Streams records to the collector in batches over persistent connection
+    '''
+    def __init__(self, address, host, batchSize=500):
+        self.batchSize = batchSize
+        self.__sock = socket.create_connection(address)
+        self.__pending = []
+        self.__batch = 0
+        sendFrame(self.__sock, {'version': PROTOCOL_VERSION, 'host': host,
+                                'started': time.time()})
+
+    def send(self, record):
+        self.__pending.append(record)
+        if len(self.__pending) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        if not self.__pending:
+            return
+        self.__batch += 1
+        sendFrame(self.__sock, {'batch': self.__batch, 'records': self.__pending})
+        reply = recvFrame(self.__sock)
+        if not reply or reply.get('ack') != self.__batch:
+            raise FleetProtocolError('Collector did not acknowledge batch %d: %r' % \
+                                     (self.__batch, reply))
+        self.__pending = []
+
+    def close(self):
+        self.flush()
+        self.__sock.close()
+
+def scanDrivers():
+    '''
+    Yields records describing OEM drivers, their packages and planned removals
+    '''
+    from driver_cleanup import getAllDrivers, findSupersededDrivers, readOemInfFiles, \
+                               getOemPackages, getFolderSize
+    drivers = getAllDrivers()
+    oemDups = findSupersededDrivers(drivers)
+    for driver in drivers.itervalues():
+        yield {'type': 'driver', 'key': driver.name, 'class': driver.driverClass,
+               'provider': driver.provider, 'signedBy': driver.signedBy,
+               'dateAndVersion': driver.driverDateAndVersion,
+               'supersededBy': oemDups.get(driver.name)}
+    for oemName, driverDir in getOemPackages(readOemInfFiles()[0]).iteritems():
+        size = getFolderSize(driverDir)
+        yield {'type': 'package', 'key': os.path.basename(driverDir), 'oemName': oemName,
+               'size': size}
+        if oemName in oemDups:
+            yield {'type': 'plan', 'key': oemName, 'scope': 'drivers', 'size': size}
+
+def scanInstallerCache(catalog=None):
+    '''
+    Yields records describing orphan Installer cache files, orphans known to the package
+    catalog are annotated with its metadata
+    '''
+    from msi_cleanup import getCachedMsiFiles, getReferencedPackages
+    from msi_helpers import getAllPatches, getAllProducts
+    for name, ext, enumerator in (('patches', 'msp', getAllPatches),
+                                  ('installs', 'msi', getAllProducts)):
+        referenced = getReferencedPackages(enumerator)
+        for fn in getCachedMsiFiles(ext):
+            if fn not in referenced:
+                size = os.path.getsize(fn)
+                record = {'type': 'orphan', 'key': fn, 'kind': name, 'size': size}
+                known = catalog.lookupFile(fn) if catalog else None
+                if known:
+                    record['digest'], record['known'] = known
+                yield record
+                yield {'type': 'plan', 'key': fn, 'scope': name, 'size': size}
+
+def scanJournals():
+    '''
+    Yields outcomes of interrupted cleanups found in journals
+    '''
+    from cleanup_journal import readJournal, getDefaultJournalPath
+    for script in ('driver_cleanup', 'msi_cleanup'):
+        # cleanup may be running right now, so the journal is only read, never repaired
+        for scope, item in readJournal(getDefaultJournalPath(script)):
+            yield {'type': 'outcome', 'key': item.key, 'scope': scope,
+                   'state': item.state, 'size': item.size, 'reclaimed': item.reclaimed}
+
+def runAgent(args):
+    host, port = args.collector.rsplit(':', 1) if ':' in args.collector else \
+                 (args.collector, DEFAULT_PORT)
+    catalog = PackageCatalog(args.catalog) if args.catalog else None
+    connection = AgentConnection((host, int(port)), socket.getfqdn(), args.batch_size)
+    count = 0
+    for records in (scanDrivers(), scanInstallerCache(catalog), scanJournals()):
+        for record in records:
+            connection.send(record)
+            count += 1
+    connection.close()
+    print 'Sent %d records to %s' % (count, args.collector)
+
+def runCollector(args):
+    collector = Collector((args.bind, args.port), RecordStore(args.db))
+    print 'Collecting records at %s:%s into %s' % (collector.server_address + (args.db, ))
+    try:
+        collector.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Gathers cleanup data from many machines')
+    subparsers = parser.add_subparsers()
+    agent = subparsers.add_parser('agent', help='scan this machine and send the results')
+    agent.add_argument('--collector', required=True, metavar='HOST[:PORT]',
+                       help='collector address')
+    agent.add_argument('--batch-size', type=int, default=500,
+                       help='number of records sent in one batch (default: %(default)s)')
+    agent.add_argument('--catalog', metavar='FILE',
+                       help='catalog of known packages used to annotate orphan files')
+    agent.set_defaults(func=runAgent)
+    collector = subparsers.add_parser('collector', help='receive results from agents')
+    collector.add_argument('--db', required=True, help='SQLite database to store records in')
+    collector.add_argument('--bind', default='0.0.0.0',
+                           help='address to listen on (default: %(default)s)')
+    collector.add_argument('--port', type=int, default=DEFAULT_PORT,
+                           help='port to listen on (default: %(default)s)')
+    collector.set_defaults(func=runCollector)
+
+    if sys.argv[1:2] == ['agent']:
+        # elevation must happen before parsing as elevated process gets an extra marker argument;
+        # Windows-only modules are imported here, so collector can run on any host
+        from win32elevate import elevateAdminRights
+        elevateAdminRights()
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -22,23 +22,35 @@ This script performs cleanup of Windows Installer cache trying to be as safe as
 it removes only *.msi/*.msp files that are not references as installed on the system (most
 likely some leftover junk after unsuccessful installations).
 
+Use --quarantine to move orphan files aside instead of deleting them, so they can be put back
+with --restore if something breaks.
+
 If you break your Windows Installer cache here's a link to MS blog describing the way to fix it:
 http://blogs.msdn.com/heaths/archive/2006/11/30/rebuilding-the-installer-cache.aspx
 '''
 from msi_helpers import getAllPatches, getAllProducts
 from win32elevate import elevateAdminRights
 from common_helpers import MB
+from cleanup_journal import DeletionJournal, getDefaultJournalPath
+from quarantine import Quarantine, QuarantineError, getQuarantineRoot
+from spill import SpillSet, SpillList, parseMemoryLimit
 import os
 import glob
 import errno
+import argparse
+import sys
+
+DELETE_MODE, QUARANTINE_MODE = 'delete', 'quarantine'
+
+def getInstallerCacheDir():
+    return os.path.join(os.getenv('SystemRoot'), 'Installer')
 
 def getCachedMsiFiles(ext):
     '''
     Finds all cached MSI files at %SystemRoot%\Installer\*.<ext>
     ext can be 'msi' (for installation) or 'msp' (for patches)
     '''
-    return [fn.lower() for fn in glob.glob(os.path.join(os.getenv('SystemRoot'), 'Installer',
-                                                        '*.%s' % ext))]
+    return [fn.lower() for fn in glob.glob(os.path.join(getInstallerCacheDir(), '*.%s' % ext))]
 
 def _rotateString(s):
     return ''.join(reversed([''.join(x) for x in zip(*[iter(s)]*2)]))
@@ -53,47 +65,166 @@ def unsquishGuid(guid):
                               _rotateString(squeezedGuid[12:16]),
                               squeezedGuid[16:20], squeezedGuid[20:]])
 
-def orphanCleanup(name, ext, enumerator):
-    files = set()
+def getReferencedPackages(enumerator, memoryLimit=None):
+    '''
+    Returns the set of cached package paths referenced by patches or products listed by
+    enumerator. If memoryLimit is given the set is moved to disk when it grows bigger.
+    '''
+    files = SpillSet(memoryLimit)
     for info in enumerator():
         try:
             files.add(info.LocalPackage.lower())
         except AttributeError:
             print 'Warning! %s has no LocalPackage attribute, ignoring its info' % info
+    return files
 
-    orphanFiles, orphanSize = [], 0
-    for fn in getCachedMsiFiles(ext):
-        if fn not in files:
-            orphanFiles.append(fn)
-            orphanSize += os.path.getsize(fn)
-    if orphanFiles:
+def removeOrphan(orphan, size, quarantine=None):
+    '''
+    Removes single orphan file (or moves it to the quarantine if given), returns True on success
+    '''
+    try:
+        if quarantine:
+            quarantine.move(orphan, size)
+        else:
+            os.remove(orphan)
+    except OSError as ex:
+        if ex.errno == errno.EACCES:
+            reason = 'access denied'
+        else:
+            reason = '%s <%r>' % (ex, ex)
+    except Exception as ex:
+        # KeyboardInterrupt and SystemExit must stop the run leaving the item started, so it
+        # is re-checked on resume
+        reason = '%s <%r>' % (ex, ex)
+    else:
+        reason = ''
+    if reason:
+        print 'Cannot remove "%s": %s' % (orphan, reason)
+    return not reason
+
+def orphanCleanup(name, ext, enumerator, journal, quarantine=None, memoryLimit=None):
+    if journal.isFinished(name):
+        print 'Cleanup of orphan %s already finished, reclaimed %s' % \
+                (name, MB(journal.reclaimed(name)))
+        return
+    mode = QUARANTINE_MODE if quarantine else DELETE_MODE
+    if journal.hasUnfinished(name):
+        # previous run was interrupted after the user agreed to delete the files,
+        # so do not rescan and ask again, just continue with what is left
+        if journal.getMode(name) not in (None, mode):
+            # resuming quarantine as deletion would defeat the quarantine
+            sys.exit('Interrupted cleanup of orphan %s was started %s --quarantine, run with '
+                     'the same options to resume it' % \
+                     (name, 'with' if journal.getMode(name) == QUARANTINE_MODE else 'without'))
+        orphanFiles = journal.resume(name, lambda orphan: not os.path.exists(orphan))
+        print 'Resuming cleanup of orphan %s (%d left, %s reclaimed so far)' % \
+                (name, len(orphanFiles), MB(journal.reclaimed(name)))
+    else:
+        files = getReferencedPackages(enumerator, memoryLimit)
+        orphanFiles, orphanSize = SpillList(memoryLimit), 0
+        for fn in getCachedMsiFiles(ext):
+            if fn not in files:
+                size = os.path.getsize(fn)
+                orphanFiles.append((fn, size))
+                orphanSize += size
+        files.close()
+        if not orphanFiles:
+            print 'Orphan %s not found' % name
+            journal.finish(name)
+            return
         answer = raw_input('Orphan %s (%d) found occupying %s space. Delete? [y(es)/n(o)] ' % \
                            (name, len(orphanFiles), MB(orphanSize))).lower()
-        if answer in ('y', 'yes'):
-            for orphan in orphanFiles:
-                try:
-                    os.remove(orphan)
-                except OSError as ex:
-                    if ex.errno == errno.EACCES:
-                        reason = 'access denied'
-                    else:
-                        reason = '%s <%r>' % (ex, ex)
-                except BaseException as ex:
-                    reason = '%s <%r>' % (ex, ex)
-                else:
-                    reason = ''
-                if reason:
-                    print 'Cannot remove "%s": %s' % (orphan, reason)
-        else:
+        if answer not in ('y', 'yes'):
             print 'Cancelled by user'
-    else:
-        print 'Orphan %s not found' % name
+            journal.finish(name)
+            return
+        journal.plan(name, orphanFiles, mode)
+
+    for orphan, size in orphanFiles:
+        journal.start(name, orphan)
+        if removeOrphan(orphan, size, quarantine):
+            journal.done(name, orphan, size)
+        else:
+            journal.failed(name, orphan)
+    journal.finish(name)
+    print '%s %s by removing orphan %s' % ('Quarantined' if quarantine else 'Reclaimed',
+                                           MB(journal.reclaimed(name)), name)
+
+def manageQuarantine(quarantine, args):
+    '''
+    Lists or restores quarantined batches as requested by command line
+    '''
+    if args.list_quarantine:
+        batches = quarantine.getBatches()
+        if not batches:
+            print 'Quarantine at %s is empty' % quarantine.root
+        for batch in batches:
+            print '%s: %s' % (batch, MB(batch.getSize()))
+    if args.restore:
+        try:
+            batch = quarantine.getBatch(args.restore)
+        except QuarantineError as err:
+            sys.exit(str(err))
+        print 'Restoring %s...' % batch,
+        failed = batch.restore()
+        if failed:
+            print 'fail'
+            for original in failed:
+                print 'Cannot restore "%s": target exists or is not accessible' % original
+        else:
+            print 'done'
 
 def main():
     elevateAdminRights()
 
-    orphanCleanup('patches', 'msp', getAllPatches)
-    orphanCleanup('installs', 'msi', getAllProducts)
+    parser = argparse.ArgumentParser(description='Cleans up orphan files in Windows Installer '
+                                                 'cache')
+    parser.add_argument('--journal', default=getDefaultJournalPath('msi_cleanup'),
+                        help='path to the journal used to resume interrupted cleanup '
+                             '(default: %(default)s)')
+    parser.add_argument('--memory-limit', type=parseMemoryLimit, default=None, metavar='ITEMS',
+                        help='keep at most that many file names in memory, spill the rest to '
+                             'temporary files')
+    parser.add_argument('--quarantine', action='store_true',
+                        help='move orphan files to the quarantine instead of deleting them')
+    parser.add_argument('--quarantine-dir',
+                        default=getQuarantineRoot(getInstallerCacheDir()),
+                        help='quarantine location, must be on the same volume as Installer '
+                             'cache (default: %(default)s)')
+    parser.add_argument('--expire-days', type=float, default=30,
+                        help='remove quarantined batches older than that (default: '
+                             '%(default)s)')
+    parser.add_argument('--expire-size', type=float, default=None,
+                        help='remove oldest quarantined batches until quarantine fits into '
+                             'that many megabytes')
+    parser.add_argument('--list-quarantine', action='store_true',
+                        help='list quarantined batches and exit')
+    parser.add_argument('--restore', metavar='BATCH',
+                        help='move files of quarantined batch back to Installer cache and exit')
+    args = parser.parse_args()
+
+    quarantine = Quarantine(args.quarantine_dir)
+    if args.list_quarantine or args.restore:
+        manageQuarantine(quarantine, args)
+        return
+
+    journal = DeletionJournal(args.journal, memoryLimit=args.memory_limit)
+    orphanCleanup('patches', 'msp', getAllPatches, journal,
+                  quarantine if args.quarantine else None, args.memory_limit)
+    orphanCleanup('installs', 'msi', getAllProducts, journal,
+                  quarantine if args.quarantine else None, args.memory_limit)
+    if args.quarantine:
+        print 'Total quarantined: %s' % MB(journal.reclaimed())
+    else:
+        print 'Total reclaimed: %s' % MB(journal.reclaimed())
+    journal.discard()
+
+    expired = quarantine.expire(maxAge=args.expire_days * 24 * 60 * 60,
+                                maxSize=args.expire_size * 1024 * 1024 \
+                                        if args.expire_size is not None else None)
+    quarantine.close()
+    if expired:
+        print 'Reclaimed %s by expiring old quarantined files' % MB(expired)
 
 if __name__ == '__main__':
     main()
@@ -65,6 +65,9 @@ class MsiPatchInfo(object):
     def getPatchGuid(self):
         return self.__patchGuid
 
+    def getProductGuid(self):
+        return self.__productGuid
+
     def __str__(self):
         return 'Patch: %s, product: %s (by %s)' % (self.__patchGuid, self.__productGuid,
                                                    self.__userSid or '<system>')
@@ -89,6 +92,9 @@ class MsiProduct(object):
     def __init__(self, productGuid):
         self.__productGuid = productGuid
 
+    def getProductGuid(self):
+        return self.__productGuid
+
     def __getattr__(self, name):
         buffSize = DWORD(10)
         result = MsiGetProductInfo(self.__productGuid, str(name), None, ctypes.byref(buffSize))
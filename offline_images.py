@@ -0,0 +1,272 @@
+'''
+Copyright (c) 2013 by JustAMan at GitHub
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+This script analyzes offline Windows installations (mounted VHDs, extracted golden images,
+etc.) the same way driver_cleanup and msi_cleanup analyze the running system, but without
+pnputil or MSI API, so it runs on any host:
+    - OEM drivers are read from oem*.inf files of the image
+    - references to Installer cache files are read from the image SOFTWARE registry hive
+Images are analyzed in parallel by a pool of processes, the result is a removal plan per image
+and a combined report. Nothing is deleted: superseded drivers of an offline image should be
+removed with "dism /Image:<root> /Remove-Driver", plan lists those commands.
+
+Note that driver signer is not known offline, so drivers are considered to be instances of
+the same driver when their class and provider match.
+'''
+
+import os
+import re
+import sys
+import json
+import ntpath
+import argparse
+import multiprocessing
+
+from common_helpers import MB
+from driver_cleanup import DriverInfo, findSupersededDrivers, readOemInfFiles, \
+                           getOemPackages, getFolderSize
+from driver_versions import parseDate, makeSortKey, MONTH_FIRST, DateFormatError
+from offline_registry import RegistryHive, HiveError
+
+INSTALLER_USERDATA = r'Microsoft\Windows\CurrentVersion\Installer\UserData'
+
+def findPath(root, *parts):
+    '''
+    Case-insensitively resolves the path inside the image, returns None if it doesn't exist
+    '''
+    path = root
+    for part in parts:
+        if os.path.exists(os.path.join(path, part)):
+            path = os.path.join(path, part)
+            continue
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return None
+        for name in names:
+            if name.lower() == part.lower():
+                path = os.path.join(path, name)
+                break
+        else:
+            return None
+    return path
+
+def _stripComment(line):
+    quoted = False
+    for index, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ';' and not quoted:
+            return line[:index]
+    return line
+
+def readInfSections(path, names=('version', 'strings')):
+    '''
+    Reads given sections of .inf file, returns a dictionary that maps lowercase section name
+    to the dictionary of its lowercase keys and values
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith('\xff\xfe'):
+        text = data[2:].decode('utf-16-le', 'replace')
+    elif data.startswith('\xef\xbb\xbf'):
+        text = data[3:].decode('utf-8', 'replace')
+    else:
+        text = data.decode('latin-1')
+    sections, current = {}, None
+    for line in text.splitlines():
+        line = _stripComment(line).strip()
+        if line.startswith('['):
+            name = line[1:].split(']', 1)[0].strip().lower()
+            # localized strings sections look like [Strings.0409]
+            current = sections.setdefault(name, {}) if name.split('.')[0] in names else None
+            continue
+        if current is None or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        current.setdefault(key.strip().lower(), value.strip())
+    return sections
+
+def readOfflineDriver(path):
+    '''
+    Creates DriverInfo for oem###.inf file using its [Version] section
+    '''
+    sections = readInfSections(path)
+    strings = {}
+    for name in sorted(sections):
+        if name.split('.')[0] == 'strings':
+            for key, value in sections[name].iteritems():
+                strings.setdefault(key, value.strip('"'))
+    def resolve(value):
+        return re.sub(r'%([^%]+)%', lambda match: strings.get(match.group(1).lower(),
+                                                              match.group(0)),
+                      value or '').strip('"')
+
+    version = sections.get('version', {})
+    driver = DriverInfo()
+    driver.name = os.path.basename(path)
+    driver.provider = resolve(version.get('provider'))
+    driver.driverClass = resolve(version.get('class'))
+    # DriverVer is always month/day/year, whatever the locale is
+    date, _, driverVersion = resolve(version.get('driverver')).partition(',')
+    driver.driverDateAndVersion = ('%s %s' % (date.strip(), driverVersion.strip())).strip()
+    driver.rawDriverDate = date.strip()
+    try:
+        driver.driverDate = parseDate(driver.rawDriverDate, MONTH_FIRST)
+    except DateFormatError:
+        driver.driverDate = driver.rawDriverDate
+    driver.driverVersion = tuple(int(x) for x in re.findall(r'(\d+)', driverVersion))
+    driver.sortKey = makeSortKey(driver.driverVersion, driver.driverDate)
+    return driver
+
+def getReferencedPackages(hivePath):
+    '''
+    Returns the set of lowercase Installer cache file names referenced by products and
+    patches registered in SOFTWARE hive
+    '''
+    userData = RegistryHive(hivePath).getRoot().getSubkey(INSTALLER_USERDATA)
+    result = set()
+    if userData is None:
+        return result
+    for user in userData.getSubkeys():
+        for kind, valuePath in (('Products', 'InstallProperties'), ('Patches', None)):
+            container = user.getSubkey(kind)
+            if container is None:
+                continue
+            for item in container.getSubkeys():
+                key = item.getSubkey(valuePath) if valuePath else item
+                localPackage = key.getValue('LocalPackage') if key else None
+                if localPackage:
+                    result.add(ntpath.basename(localPackage).lower())
+    return result
+
+def _fillPlan(root, plan):
+    windows = findPath(root, 'Windows')
+    if not windows:
+        plan['errors'].append('Windows directory not found')
+        return
+
+    infDir = findPath(windows, 'INF')
+    driverRepo = findPath(windows, 'System32', 'DriverStore', 'FileRepository')
+    if infDir and driverRepo:
+        try:
+            oemFiles = readOemInfFiles(infDir)[0]
+            drivers = dict((driver.name, driver) for driver in
+                           (readOfflineDriver(os.path.join(infDir, oemName))
+                            for oemName in oemFiles.itervalues()))
+            oemDups = findSupersededDrivers(drivers)
+            for oemName, driverDir in getOemPackages(oemFiles, driverRepo).iteritems():
+                if oemName in oemDups:
+                    plan['drivers'].append({'name': oemName, 'driver': str(drivers[oemName]),
+                                            'size': getFolderSize(driverDir),
+                                            'supersededBy': oemDups[oemName]})
+        except (IOError, OSError), err:
+            plan['errors'].append('Cannot analyze drivers: %s' % err)
+    else:
+        plan['errors'].append('INF or DriverStore directory not found')
+
+    installerDir = findPath(windows, 'Installer')
+    hivePath = findPath(windows, 'System32', 'config', 'SOFTWARE')
+    if installerDir and hivePath:
+        try:
+            referenced = getReferencedPackages(hivePath)
+            for name in sorted(os.listdir(installerDir)):
+                kind = {'.msp': 'patches', '.msi': 'installs'}.get(
+                            os.path.splitext(name)[1].lower())
+                if kind and name.lower() not in referenced:
+                    path = os.path.join(installerDir, name)
+                    plan[kind].append({'path': path, 'size': os.path.getsize(path)})
+        except (IOError, OSError, HiveError), err:
+            plan['errors'].append('Cannot analyze Installer cache: %s' % err)
+    elif installerDir:
+        plan['errors'].append('SOFTWARE registry hive not found')
+
+def analyzeImage(root):
+    '''
+    Builds removal plan for single offline image. This runs in worker processes, so all
+    errors are reported in the result.
+    '''
+    plan = {'root': root, 'drivers': [], 'patches': [], 'installs': [], 'errors': []}
+    try:
+        _fillPlan(root, plan)
+    except Exception, err:
+        # corrupt image must not abort analysis of all other images in the pool
+        plan['errors'].append('Cannot analyze image: %s <%r>' % (err, err))
+    return plan
+
+def getPlanSize(plan, kind):
+    return sum(item['size'] for item in plan[kind])
+
+def printReport(plans, verbose):
+    totals = dict.fromkeys(('drivers', 'patches', 'installs'), 0)
+    for plan in plans:
+        print '%s:' % plan['root']
+        for error in plan['errors']:
+            print '    Warning! %s' % error
+        for kind, title in (('drivers', 'superseded drivers'), ('patches', 'orphan patches'),
+                            ('installs', 'orphan installs')):
+            size = getPlanSize(plan, kind)
+            totals[kind] += size
+            print '    %s (%d): %s' % (title, len(plan[kind]), MB(size))
+            if not verbose:
+                continue
+            for item in plan[kind]:
+                if kind == 'drivers':
+                    print '        %s: %s (probably superseded by %s)' % \
+                            (item['driver'], MB(item['size']), item['supersededBy'])
+                    print '            dism /Image:"%s" /Remove-Driver /Driver:%s' % \
+                            (plan['root'], item['name'])
+                else:
+                    print '        %s: %s' % (item['path'], MB(item['size']))
+    print 'Total for %d images: drivers %s, patches %s, installs %s, all %s' % \
+            (len(plans), MB(totals['drivers']), MB(totals['patches']), MB(totals['installs']),
+             MB(sum(totals.values())))
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyzes offline Windows images and builds '
+                                                 'cleanup plans for them')
+    parser.add_argument('roots', nargs='+', metavar='ROOT',
+                        help='root of offline Windows image (the one containing Windows dir)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of images analyzed at once (default: number of CPUs)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write plans of all images to FILE as JSON')
+    parser.add_argument('--verbose', action='store_true',
+                        help='list every planned item and dism commands for drivers')
+    args = parser.parse_args()
+
+    pool = multiprocessing.Pool(args.workers)
+    try:
+        plans = pool.map(analyzeImage, [os.path.abspath(root) for root in args.roots],
+                         chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    printReport(plans, args.verbose)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(plans, f, indent=1, sort_keys=True)
+    if any(plan['errors'] for plan in plans):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,169 @@
+'''
+Copyright (c) 2013 by JustAMan at GitHub
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Helper module that reads registry hive files (e.g. Windows\System32\config\SOFTWARE of an
+offline Windows installation) without any Windows API, so it works on any host.
+
+Only what's needed for reading keys and string values is implemented; transaction logs of
+dirty hives are not replayed, so very recent changes of a hive that was not cleanly unloaded
+may be missing.
+'''
+
+import struct
+
+HBIN_START = 0x1000
+KEY_COMP_NAME = 0x20
+VALUE_COMP_NAME = 0x1
+REG_SZ = 1
+REG_EXPAND_SZ = 2
+DATA_INLINE = 0x80000000
+
+class HiveError(Exception):
+    pass
+
+def _unpack(fmt, data, offset=0):
+    '''
+    struct.unpack_from() reporting truncated or corrupt cells as HiveError
+    '''
+    try:
+        return struct.unpack_from(fmt, data, offset)
+    except struct.error:
+        raise HiveError('Cell of %d bytes is too short to read %r at 0x%x' % \
+                        (len(data), fmt, offset))
+
+def _decodeName(raw, compressed):
+    return raw.decode('latin-1') if compressed else raw.decode('utf-16-le', 'replace')
+
+class RegistryKey(object):
+    '''
+    Key of an offline hive
+    '''
+    def __init__(self, hive, offset):
+        self.__hive = hive
+        self.__offset = offset
+        data = hive.getCell(offset)
+        if data[:2] != 'nk':
+            raise HiveError('Expected key cell at 0x%x' % offset)
+        flags, = _unpack('<H', data, 2)
+        self.__subkeyCount, = _unpack('<I', data, 0x14)
+        self.__subkeyList, = _unpack('<I', data, 0x1C)
+        self.__valueCount, = _unpack('<I', data, 0x24)
+        self.__valueList, = _unpack('<I', data, 0x28)
+        nameLength, = _unpack('<H', data, 0x48)
+        self.name = _decodeName(data[0x4C:0x4C + nameLength], flags & KEY_COMP_NAME)
+
+    def getSubkeys(self):
+        if not self.__subkeyCount:
+            return []
+        return [RegistryKey(self.__hive, offset)
+                for offset in self.__hive.getSubkeyOffsets(self.__subkeyList)]
+
+    def getSubkey(self, path):
+        '''
+        Returns subkey by backslash-separated path (case-insensitive) or None
+        '''
+        key = self
+        for name in path.split('\\'):
+            for subkey in key.getSubkeys():
+                if subkey.name.lower() == name.lower():
+                    key = subkey
+                    break
+            else:
+                return None
+        return key
+
+    def getValues(self):
+        '''
+        Returns a dictionary that maps lowercase value names to their data; string values are
+        decoded, others are returned as raw bytes
+        '''
+        result = {}
+        if not self.__valueCount:
+            return result
+        offsets = self.__hive.getCell(self.__valueList)
+        for index in xrange(self.__valueCount):
+            offset, = _unpack('<I', offsets, index * 4)
+            name, valueType, data = self.__hive.readValue(offset)
+            if valueType in (REG_SZ, REG_EXPAND_SZ):
+                data = data.decode('utf-16-le', 'replace').split(u'\0', 1)[0]
+            result[name.lower()] = data
+        return result
+
+    def getValue(self, name, default=None):
+        return self.getValues().get(name.lower(), default)
+
+class RegistryHive(object):
+    '''
+    Whole hive file read into memory
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.__data = f.read()
+        if self.__data[:4] != 'regf':
+            raise HiveError('%s is not a registry hive' % path)
+        self.__rootOffset, = _unpack('<I', self.__data, 0x24)
+
+    def getRoot(self):
+        return RegistryKey(self, self.__rootOffset)
+
+    def getCell(self, offset):
+        start = HBIN_START + offset
+        try:
+            size, = struct.unpack_from('<i', self.__data, start)
+        except struct.error:
+            raise HiveError('Cell offset 0x%x is out of the hive' % offset)
+        # allocated cells have negative size
+        return self.__data[start + 4:start + abs(size)]
+
+    def getSubkeyOffsets(self, listOffset):
+        data = self.getCell(listOffset)
+        signature, count = data[:2], _unpack('<H', data, 2)[0]
+        if signature in ('lf', 'lh'):
+            return [_unpack('<I', data, 4 + index * 8)[0] for index in xrange(count)]
+        if signature == 'li':
+            return [_unpack('<I', data, 4 + index * 4)[0] for index in xrange(count)]
+        if signature == 'ri':
+            result = []
+            for index in xrange(count):
+                result.extend(self.getSubkeyOffsets(_unpack('<I', data, 4 + index * 4)[0]))
+            return result
+        raise HiveError('Unknown subkey list signature %r at 0x%x' % (signature, listOffset))
+
+    def readValue(self, offset):
+        '''
+        Returns (name, type, raw data) of the value
+        '''
+        data = self.getCell(offset)
+        if data[:2] != 'vk':
+            raise HiveError('Expected value cell at 0x%x' % offset)
+        nameLength, dataSize, dataOffset, valueType, flags = \
+                _unpack('<HIIIH', data, 2)
+        name = _decodeName(data[20:20 + nameLength], flags & VALUE_COMP_NAME)
+        if dataSize & DATA_INLINE:
+            raw = data[8:8 + (dataSize & ~DATA_INLINE)]
+        else:
+            # big data ("db" cells) is used only for values over 16K, we don't need those
+            raw = self.getCell(dataOffset)[:dataSize]
+        return name, valueType, raw
+
+if __name__ == '__main__':
+    import sys
+    sys.stderr.write('This is helper module not intended for standalone run\n')
+    sys.exit(1)
@@ -0,0 +1,277 @@
+'''
+Copyright (c) 2013 by JustAMan at GitHub
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+This script builds and queries catalog of well-known driver package files and cached MSI
+packages, so scanners on many machines don't have to read them completely: a file is looked
+up by its size and digest of its first block, and the catalog provides digest of the whole
+file and its metadata (driver class, provider, version, product or patch GUID).
+
+Catalog is a single binary file meant to be distributed and memory-mapped:
+    header, Bloom filter of all keys, sorted fixed-size records, JSON metadata blobs
+Bloom filter answers most "not in catalog" questions without touching the records at all,
+otherwise the record is found by binary search.
+
+    package_catalog.py build OUT        catalog files of this machine (run on reference host)
+    package_catalog.py merge OUT IN...  merge catalogs of several reference hosts
+    package_catalog.py lookup CATALOG FILE...
+
+Note that size and first block do not prove files are identical, so catalog answers are good
+for reports and estimations, but not for deciding what to delete. Keys seen with different
+whole file digests are kept in the catalog only as markers and are never answered.
+'''
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+
+from driver_duplicates import hashHead, hashFull
+
+MAGIC = 'PWCCAT\0\0'
+VERSION = 1
+HEADER = struct.Struct('!8sIIQQ')
+# size, digest of the first block, digest of the whole file, metadata offset and length
+RECORD = struct.Struct('!Q20s20sII')
+KEY_SIZE = 28
+# whole file digest of keys shared by different files, such keys are never answered
+AMBIGUOUS = '\0' * 20
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+
+class CatalogError(Exception):
+    pass
+
+def makeKey(size, headDigest):
+    return struct.pack('!Q', size) + headDigest.decode('hex')
+
+def _bloomPositions(key, bits, hashes):
+    digest = hashlib.sha1(key).digest()
+    h1, h2 = struct.unpack('!QQ', digest[:16])
+    return [(h1 + i * h2) % bits for i in xrange(hashes)]
+
+class CatalogBuilder(object):
+    '''
+    Collects catalog entries in memory and writes them into catalog file
+    '''
+    def __init__(self):
+        self.__entries = {}
+
+    def __addEntry(self, key, fullDigest, meta):
+        known = self.__entries.get(key)
+        if known is None:
+            self.__entries[key] = (fullDigest, meta)
+        elif known[0] != fullDigest:
+            # different files with the same size and first block (e.g. DLLs of different
+            # driver versions), keep the key marked so merged catalogs won't answer it either
+            self.__entries[key] = (AMBIGUOUS, None)
+
+    def add(self, size, headDigest, fullDigest, meta):
+        self.__addEntry(makeKey(size, headDigest), fullDigest.decode('hex'), meta)
+
+    def addFile(self, path, meta):
+        size = os.path.getsize(path)
+        if size:
+            self.add(size, hashHead(path), hashFull(path), meta)
+
+    def addCatalog(self, catalog):
+        for key, fullDigest, meta in catalog.iterRecords():
+            self.__addEntry(key, fullDigest, meta)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def write(self, path):
+        keys = sorted(self.__entries)
+        bits = max(64, len(keys) * BLOOM_BITS_PER_KEY)
+        bloom = bytearray((bits + 7) // 8)
+        records, blobs, blobSize = [], [], 0
+        for key in keys:
+            for pos in _bloomPositions(key, bits, BLOOM_HASHES):
+                bloom[pos // 8] |= 1 << (pos % 8)
+            fullDigest, meta = self.__entries[key]
+            blob = json.dumps(meta, separators=(',', ':'), sort_keys=True)
+            size, = struct.unpack('!Q', key[:8])
+            records.append(RECORD.pack(size, key[8:], fullDigest, blobSize, len(blob)))
+            blobs.append(blob)
+            blobSize += len(blob)
+        tmpPath = '%s.tmp' % path
+        with open(tmpPath, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, BLOOM_HASHES, bits, len(keys)))
+            f.write(bloom)
+            f.writelines(records)
+            f.writelines(blobs)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmpPath, path)
+
+class PackageCatalog(object):
+    '''
+    Memory-mapped read-only catalog
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error):
+                raise CatalogError('Catalog %s is empty or cannot be mapped' % path)
+        try:
+            magic, version, self.__hashes, self.__bits, self.__count = \
+                    HEADER.unpack_from(self.__map)
+        except struct.error:
+            magic, version = None, None
+        if magic != MAGIC or version != VERSION:
+            self.__map.close()
+            raise CatalogError('%s is not a package catalog of version %s' % (path, VERSION))
+        self.__recordsStart = HEADER.size + (self.__bits + 7) // 8
+        self.__blobsStart = self.__recordsStart + self.__count * RECORD.size
+
+    def __len__(self):
+        return self.__count
+
+    def mightContain(self, key):
+        '''
+        Bloom filter check, False means the key is definitely not in the catalog
+        '''
+        bloomStart = HEADER.size
+        for pos in _bloomPositions(key, self.__bits, self.__hashes):
+            if not ord(self.__map[bloomStart + pos // 8]) & (1 << (pos % 8)):
+                return False
+        return True
+
+    def __getKey(self, index):
+        offset = self.__recordsStart + index * RECORD.size
+        return self.__map[offset:offset + KEY_SIZE]
+
+    def __readRecord(self, index):
+        size, head, fullDigest, metaOffset, metaLen = \
+                RECORD.unpack_from(self.__map, self.__recordsStart + index * RECORD.size)
+        start = self.__blobsStart + metaOffset
+        return fullDigest, json.loads(self.__map[start:start + metaLen])
+
+    def lookup(self, size, headDigest):
+        '''
+        Returns (whole file digest, metadata) of a known file or None if it's unknown or
+        several different files have the same size and first block
+        '''
+        key = makeKey(size, headDigest)
+        if not self.mightContain(key):
+            return None
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            if self.__getKey(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.__count and self.__getKey(low) == key:
+            fullDigest, meta = self.__readRecord(low)
+            if fullDigest != AMBIGUOUS:
+                return fullDigest.encode('hex'), meta
+        return None
+
+    def lookupFile(self, path):
+        size = os.path.getsize(path)
+        return self.lookup(size, hashHead(path)) if size else None
+
+    def iterRecords(self):
+        for index in xrange(self.__count):
+            fullDigest, meta = self.__readRecord(index)
+            yield self.__getKey(index), fullDigest, meta
+
+    def close(self):
+        self.__map.close()
+
+def collectSystemEntries(builder):
+    '''
+    Adds OEM driver packages and referenced Installer cache files of this machine to the
+    catalog builder
+    '''
+    from driver_cleanup import getAllDrivers, readOemInfFiles, getOemPackages
+    from msi_helpers import getAllPatches, getAllProducts
+    drivers = getAllDrivers()
+    for oemName, driverDir in getOemPackages(readOemInfFiles()[0]).iteritems():
+        driver = drivers.get(oemName)
+        if not driver:
+            continue
+        meta = {'package': os.path.basename(driverDir), 'class': driver.driverClass,
+                'provider': driver.provider, 'version': driver.driverDateAndVersion}
+        for root, dirs, files in os.walk(driverDir):
+            for fileName in files:
+                path = os.path.join(root, fileName)
+                builder.addFile(path, dict(meta, file=os.path.relpath(path, driverDir)))
+    for info in getAllPatches():
+        try:
+            path = info.LocalPackage
+        except AttributeError:
+            continue
+        builder.addFile(path, {'patch': info.getPatchGuid(), 'product': info.getProductGuid()})
+    for info in getAllProducts():
+        try:
+            path = info.LocalPackage
+        except AttributeError:
+            continue
+        meta = {'product': info.getProductGuid()}
+        try:
+            meta['name'] = info.ProductName
+        except AttributeError:
+            pass
+        builder.addFile(path, meta)
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds and queries catalog of known driver '
+                                                 'and MSI package files')
+    subparsers = parser.add_subparsers(dest='command')
+    build = subparsers.add_parser('build', help='catalog files of this machine')
+    build.add_argument('output')
+    merge = subparsers.add_parser('merge', help='merge several catalogs into one')
+    merge.add_argument('output')
+    merge.add_argument('inputs', nargs='+')
+    lookup = subparsers.add_parser('lookup', help='look files up in the catalog')
+    lookup.add_argument('catalog')
+    lookup.add_argument('files', nargs='+')
+
+    if sys.argv[1:2] == ['build']:
+        # elevation must happen before parsing as elevated process gets an extra marker argument
+        from win32elevate import elevateAdminRights
+        elevateAdminRights()
+    args = parser.parse_args()
+
+    if args.command == 'lookup':
+        catalog = PackageCatalog(args.catalog)
+        for path in args.files:
+            print '%s: %s' % (path, catalog.lookupFile(path) or 'unknown')
+        catalog.close()
+        return
+    builder = CatalogBuilder()
+    if args.command == 'build':
+        collectSystemEntries(builder)
+    else:
+        for path in args.inputs:
+            catalog = PackageCatalog(path)
+            builder.addCatalog(catalog)
+            catalog.close()
+    builder.write(args.output)
+    print 'Catalog of %d files written to %s' % (len(builder), args.output)
+
+if __name__ == '__main__':
+    main()
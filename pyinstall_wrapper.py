@@ -80,7 +80,7 @@ class PyInstallerWrap(object):
             if os.path.isdir(directory):
                 shutil.rmtree(directory)
 
-SCRIPTS = ('msi_cleanup', 'driver_cleanup')
+SCRIPTS = ('msi_cleanup', 'driver_cleanup', 'space_watch', 'fleet', 'package_catalog')
 
 def main():
     if len(sys.argv) != 2:
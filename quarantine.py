@@ -0,0 +1,205 @@
+'''
+Copyright (c) 2013 by JustAMan at GitHub
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Helper module that implements quarantine for removed files: instead of deleting files are
+renamed into a staging directory on the same volume (which is O(1) and does not copy any
+data), so a whole batch can be quickly put back if something goes wrong.
+
+Each cleanup run creates a batch directory with an index file listing moved files:
+    <stored name> <original path> <size>
+Index records are written before the file is moved, so index always covers batch contents.
+'''
+
+import os
+import time
+import shutil
+
+INDEX_NAME = 'index.txt'
+BATCH_TIME_FORMAT = '%Y%m%d-%H%M%S'
+
+class QuarantineError(Exception):
+    pass
+
+class QuarantineBatch(object):
+    '''
+    Single batch of quarantined files, usually corresponds to one cleanup run
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.__index = None
+        self.__count = 0
+
+    def getItems(self):
+        '''
+        Returns the list of (stored path, original path, size) tuples of the batch
+        '''
+        items = []
+        try:
+            with open(os.path.join(self.path, INDEX_NAME), 'rb') as f:
+                lines = f.read().splitlines()
+        except IOError:
+            return items
+        for line in lines:
+            try:
+                storedName, original, size = line.split('\t')
+                items.append((os.path.join(self.path, storedName), original, int(size)))
+            except ValueError:
+                continue
+        return items
+
+    def getSize(self):
+        return sum(size for stored, original, size in self.getItems()
+                   if os.path.exists(stored))
+
+    def getCreated(self):
+        try:
+            return time.mktime(time.strptime(self.name, BATCH_TIME_FORMAT))
+        except ValueError:
+            return os.path.getmtime(self.path)
+
+    def add(self, path, size):
+        '''
+        Moves the file into the batch
+        '''
+        if self.__index is None:
+            self.__count = len(self.getItems())
+            self.__index = open(os.path.join(self.path, INDEX_NAME), 'ab')
+        storedName = '%06d_%s' % (self.__count, os.path.basename(path))
+        self.__count += 1
+        self.__index.write('%s\t%s\t%d\n' % (storedName, path, size))
+        self.__index.flush()
+        os.rename(path, os.path.join(self.path, storedName))
+
+    def close(self):
+        if self.__index is not None:
+            self.__index.close()
+            self.__index = None
+
+    def restore(self):
+        '''
+        Moves all files of the batch back to their original places.
+        Returns the list of original paths that could not be restored.
+        '''
+        self.close()
+        failed = []
+        for stored, original, size in self.getItems():
+            if not os.path.exists(stored):
+                # file was never moved (e.g. rename failed) or was already restored
+                continue
+            if os.path.exists(original):
+                failed.append(original)
+                continue
+            try:
+                os.rename(stored, original)
+            except OSError:
+                failed.append(original)
+        if not failed:
+            self.remove()
+        return failed
+
+    def remove(self):
+        self.close()
+        shutil.rmtree(self.path)
+
+    def __str__(self):
+        return '%s (%d files)' % (self.name, len(self.getItems()))
+
+class Quarantine(object):
+    '''
+    Staging directory that holds batches of quarantined files
+    '''
+    def __init__(self, root):
+        self.root = root
+        self.__batch = None
+
+    def getBatches(self):
+        '''
+        Returns all batches sorted from oldest to newest
+        '''
+        if not os.path.isdir(self.root):
+            return []
+        batches = [QuarantineBatch(os.path.join(self.root, name))
+                   for name in os.listdir(self.root)
+                   if os.path.isdir(os.path.join(self.root, name))]
+        batches.sort(key=lambda batch: batch.getCreated())
+        return batches
+
+    def getBatch(self, name):
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(path):
+            raise QuarantineError('Quarantine batch "%s" not found in %s' % (name, self.root))
+        return QuarantineBatch(path)
+
+    def move(self, path, size):
+        '''
+        Moves the file into current batch of the quarantine creating it if needed
+        '''
+        if self.__batch is None:
+            name = time.strftime(BATCH_TIME_FORMAT)
+            batchPath = os.path.join(self.root, name)
+            suffix = 0
+            while os.path.exists(batchPath):
+                suffix += 1
+                batchPath = os.path.join(self.root, '%s.%d' % (name, suffix))
+            os.makedirs(batchPath)
+            self.__batch = QuarantineBatch(batchPath)
+        self.__batch.add(path, size)
+
+    def close(self):
+        if self.__batch is not None:
+            self.__batch.close()
+            self.__batch = None
+
+    def expire(self, maxAge=None, maxSize=None):
+        '''
+        Removes the oldest batches that are older than maxAge seconds and then the oldest ones
+        until total quarantine size fits into maxSize bytes. Current batch is never removed.
+        Returns the number of bytes freed.
+        '''
+        current = self.__batch.path if self.__batch else None
+        batches = [(batch, batch.getSize()) for batch in self.getBatches()
+                   if batch.path != current]
+        totalSize = sum(size for batch, size in batches)
+        if current:
+            totalSize += self.__batch.getSize()
+        now, freed = time.time(), 0
+        for batch, size in batches:
+            tooOld = maxAge is not None and now - batch.getCreated() > maxAge
+            tooBig = maxSize is not None and totalSize > maxSize
+            if not (tooOld or tooBig):
+                continue
+            batch.remove()
+            totalSize -= size
+            freed += size
+        return freed
+
+def getQuarantineRoot(path):
+    '''
+    Returns default quarantine location on the same volume as given path, so that moving
+    files to the quarantine is a simple rename
+    '''
+    drive = os.path.splitdrive(os.path.abspath(path))[0]
+    return os.path.join(drive + os.sep, 'pyWinClobber.quarantine')
+
+if __name__ == '__main__':
+    import sys
+    sys.stderr.write('This is helper module not intended for standalone run\n')
+    sys.exit(1)
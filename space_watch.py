@@ -0,0 +1,336 @@
+'''
+Copyright (c) 2013 by JustAMan at GitHub
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+This script keeps track of space that driver_cleanup and msi_cleanup could reclaim without
+rescanning everything each time. It takes a baseline scan and then waits for changes in
+%SystemRoot%\inf, DriverStore\FileRepository and %SystemRoot%\Installer (using change
+notifications or, where they're not available, polling directory modification times) and
+updates only what has changed.
+
+Current totals are served as JSON by a small HTTP server listening on localhost, e.g.:
+    http://127.0.0.1:8765/
+'''
+
+from win32elevate import elevateAdminRights
+from common_helpers import MB
+from driver_cleanup import getAllDrivers, findSupersededDrivers, readOemInfFiles, \
+                           getOemPackages, getPackageOem, getDriverRepo, getFolderSize
+from msi_cleanup import getInstallerCacheDir, getReferencedPackages
+from msi_helpers import getAllPatches, getAllProducts
+import os
+import time
+import json
+import fnmatch
+import argparse
+import threading
+import BaseHTTPServer
+
+import ctypes
+from ctypes.wintypes import HANDLE, BOOL, DWORD, LPCWSTR
+
+FindFirstChangeNotification = ctypes.windll.kernel32.FindFirstChangeNotificationW
+FindFirstChangeNotification.argtypes = (LPCWSTR, BOOL, DWORD)
+FindFirstChangeNotification.restype = HANDLE
+
+FindNextChangeNotification = ctypes.windll.kernel32.FindNextChangeNotification
+FindNextChangeNotification.argtypes = (HANDLE, )
+FindNextChangeNotification.restype = BOOL
+
+FindCloseChangeNotification = ctypes.windll.kernel32.FindCloseChangeNotification
+FindCloseChangeNotification.argtypes = (HANDLE, )
+FindCloseChangeNotification.restype = BOOL
+
+WaitForMultipleObjects = ctypes.windll.kernel32.WaitForMultipleObjects
+WaitForMultipleObjects.argtypes = (DWORD, ctypes.POINTER(HANDLE), BOOL, DWORD)
+WaitForMultipleObjects.restype = DWORD
+
+FILE_NOTIFY_CHANGE_FILE_NAME = 0x1
+FILE_NOTIFY_CHANGE_DIR_NAME = 0x2
+FILE_NOTIFY_CHANGE_SIZE = 0x8
+FILE_NOTIFY_CHANGE_LAST_WRITE = 0x10
+INVALID_HANDLE_VALUE = HANDLE(-1).value
+WAIT_OBJECT_0 = 0
+WAIT_TIMEOUT = 0x102
+
+# changes usually come in bursts (e.g. driver installation), wait a bit to catch all of them
+SETTLE_DELAY = 2
+
+class ChangeNotifier(object):
+    '''
+    Waits for changes in given directories using Win32 change notifications
+    '''
+    FLAGS = FILE_NOTIFY_CHANGE_FILE_NAME | FILE_NOTIFY_CHANGE_DIR_NAME | \
+            FILE_NOTIFY_CHANGE_SIZE | FILE_NOTIFY_CHANGE_LAST_WRITE
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        handles = []
+        for path in self.paths:
+            handle = FindFirstChangeNotification(unicode(path), False, self.FLAGS)
+            if handle == INVALID_HANDLE_VALUE:
+                for opened in handles:
+                    FindCloseChangeNotification(opened)
+                raise ctypes.WinError()
+            handles.append(handle)
+        self.__handles = (HANDLE * len(handles))(*handles)
+
+    def wait(self, timeout):
+        '''
+        Waits up to timeout seconds, returns the list of changed directories
+        '''
+        result = WaitForMultipleObjects(len(self.paths), self.__handles, False,
+                                        int(timeout * 1000))
+        if result == WAIT_TIMEOUT:
+            return []
+        index = result - WAIT_OBJECT_0
+        if not 0 <= index < len(self.paths):
+            raise ctypes.WinError()
+        time.sleep(SETTLE_DELAY)
+        if not FindNextChangeNotification(self.__handles[index]):
+            raise ctypes.WinError()
+        return [self.paths[index]]
+
+    def close(self):
+        for handle in self.__handles:
+            FindCloseChangeNotification(handle)
+
+class PollingNotifier(object):
+    '''
+    Detects changes in given directories by polling their modification time, which changes
+    when files are added, removed or renamed in the directory
+    '''
+    def __init__(self, paths, interval):
+        self.interval = interval
+        self.__mtimes = dict((path, self.__getMtime(path)) for path in paths)
+
+    @staticmethod
+    def __getMtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        changed = []
+        for path, mtime in self.__mtimes.items():
+            current = self.__getMtime(path)
+            if current != mtime:
+                self.__mtimes[path] = current
+                changed.append(path)
+        return changed
+
+    def close(self):
+        pass
+
+def listDirectory(path, pattern='*'):
+    '''
+    Returns a dictionary that maps names of directory entries matching the pattern to
+    their (modification time, size)
+    '''
+    result = {}
+    for name in os.listdir(path):
+        if not fnmatch.fnmatch(name.lower(), pattern):
+            continue
+        try:
+            stat = os.stat(os.path.join(path, name))
+        except OSError:
+            continue
+        result[name] = (stat.st_mtime, stat.st_size)
+    return result
+
+class SpaceTracker(object):
+    '''
+    Keeps per-package sizes and orphan status up to date and computes reclaimable totals
+    '''
+    def __init__(self):
+        self.infDir = os.path.join(os.getenv('SystemRoot'), 'inf')
+        self.driverRepo = getDriverRepo()
+        self.installerDir = getInstallerCacheDir()
+        self.__lock = threading.Lock()
+        self.__infSnapshot = {}
+        self.__oemFiles = {}
+        self.__oemDups = {}
+        self.__packageOem = {}
+        self.__packageSizes = {}
+        self.__installerFiles = {}
+        self.__referenced = set()
+        self.__totals = {}
+
+    def getPaths(self):
+        return (self.infDir, self.driverRepo, self.installerDir)
+
+    def refreshInf(self):
+        '''
+        Re-reads drivers info if any oem*.inf file was added, removed or changed
+        '''
+        snapshot = listDirectory(self.infDir, 'oem*.inf')
+        if snapshot == self.__infSnapshot:
+            return False
+        self.__infSnapshot = snapshot
+        self.__oemDups = findSupersededDrivers(getAllDrivers())
+        self.__oemFiles = readOemInfFiles()[0]
+        self.__packageOem = dict((os.path.basename(driverDir), oemName) for oemName, driverDir
+                                 in getOemPackages(self.__oemFiles).iteritems())
+        return True
+
+    def refreshDriverStore(self):
+        '''
+        Calculates sizes of newly added packages and forgets removed ones
+        '''
+        packages = set(name for name in os.listdir(self.driverRepo)
+                       if os.path.isdir(os.path.join(self.driverRepo, name)))
+        known = set(self.__packageSizes)
+        if packages == known:
+            return False
+        for package in known - packages:
+            del self.__packageSizes[package]
+            self.__packageOem.pop(package, None)
+        for package in packages - known:
+            try:
+                self.__packageSizes[package] = getFolderSize(os.path.join(self.driverRepo,
+                                                                          package))
+            except OSError:
+                # package is being added or removed right now, next notification will fix it
+                continue
+            # only new packages are matched to oem*.inf files, rereading all of them is
+            # exactly the full scan watching is meant to avoid
+            oemName = getPackageOem(self.__oemFiles, self.driverRepo, package)
+            if oemName:
+                self.__packageOem[package] = oemName
+        return True
+
+    def refreshInstaller(self):
+        '''
+        Updates the list of cached MSI files and re-queries which of them are referenced
+        '''
+        snapshot = dict((os.path.join(self.installerDir, name).lower(), size)
+                        for name, (mtime, size) in listDirectory(self.installerDir,
+                                                                 '*.ms[ip]').iteritems())
+        if snapshot == self.__installerFiles:
+            return False
+        self.__installerFiles = snapshot
+        self.__referenced = getReferencedPackages(getAllPatches)
+        self.__referenced.update(getReferencedPackages(getAllProducts))
+        return True
+
+    def refresh(self, paths):
+        '''
+        Refreshes the state after the change of given directories and recomputes totals
+        '''
+        changed = False
+        if self.infDir in paths:
+            changed = self.refreshInf() or changed
+        if self.driverRepo in paths or changed:
+            changed = self.refreshDriverStore() or changed
+        if self.installerDir in paths:
+            changed = self.refreshInstaller() or changed
+        if changed or not self.__totals:
+            self.__updateTotals()
+        return changed
+
+    def __updateTotals(self):
+        drivers = [(package, size) for package, size in self.__packageSizes.iteritems()
+                   if self.__packageOem.get(package) in self.__oemDups]
+        totals = {'updated': time.time(),
+                  'drivers': {'count': len(drivers),
+                              'reclaimable': sum(size for package, size in drivers)}}
+        for name, ext in (('patches', '.msp'), ('installs', '.msi')):
+            orphans = [size for path, size in self.__installerFiles.iteritems()
+                       if path.endswith(ext) and path not in self.__referenced]
+            totals[name] = {'count': len(orphans), 'reclaimable': sum(orphans)}
+        totals['reclaimable'] = sum(totals[name]['reclaimable']
+                                    for name in ('drivers', 'patches', 'installs'))
+        with self.__lock:
+            self.__totals = totals
+
+    def getTotals(self):
+        with self.__lock:
+            return dict(self.__totals)
+
+class TotalsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(self.server.tracker.getTotals(), sort_keys=True)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): #pylint: disable=W0622
+        # do not spam the console with every monitoring request
+        pass
+
+def startQueryServer(tracker, address, port):
+    server = BaseHTTPServer.HTTPServer((address, port), TotalsHandler)
+    server.tracker = tracker
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def main():
+    elevateAdminRights()
+
+    parser = argparse.ArgumentParser(description='Watches for changes and keeps reclaimable '
+                                                 'space totals up to date')
+    parser.add_argument('--bind', default='127.0.0.1',
+                        help='address to serve totals on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='port to serve totals on (default: %(default)s)')
+    parser.add_argument('--poll', action='store_true',
+                        help='poll directories instead of using change notifications')
+    parser.add_argument('--interval', type=float, default=60,
+                        help='polling interval in seconds (default: %(default)s)')
+    args = parser.parse_args()
+
+    tracker = SpaceTracker()
+    print 'Taking baseline...',
+    tracker.refresh(tracker.getPaths())
+    print 'done'
+
+    if args.poll:
+        notifier = PollingNotifier(tracker.getPaths(), args.interval)
+    else:
+        try:
+            notifier = ChangeNotifier(tracker.getPaths())
+        except WindowsError, err:
+            print 'Change notifications are not available (%s), polling instead' % err
+            notifier = PollingNotifier(tracker.getPaths(), args.interval)
+
+    server = startQueryServer(tracker, args.bind, args.port)
+    print 'Serving totals at http://%s:%s/' % server.server_address
+    try:
+        while True:
+            totals = tracker.getTotals()
+            print '%s: %s reclaimable' % (time.strftime('%Y-%m-%d %H:%M:%S'),
+                                          MB(totals['reclaimable']))
+            changed = []
+            while not changed:
+                changed = notifier.wait(args.interval)
+            tracker.refresh(changed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        notifier.close()
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+'''
+Copyright (c) 2013 by JustAMan at GitHub
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Helper module with containers that keep at most given number of items in memory and spill
+the rest to temporary files, so huge inventories can be processed on machines with little
+RAM. While the limit is not reached (or if it's None) they behave exactly like their in-memory
+counterparts.
+'''
+
+import os
+import argparse
+import sqlite3
+import tempfile
+import cPickle as pickle
+
+class SpillSet(object):
+    '''
+    Set of byte strings that moves into on-disk SQLite table once it grows over the limit
+    '''
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.__items = set()
+        self.__db = None
+        self.__path = None
+
+    def __spill(self):
+        fd, self.__path = tempfile.mkstemp(prefix='pyWinClobber_', suffix='.set')
+        os.close(fd)
+        self.__db = sqlite3.connect(self.__path)
+        # nobody else needs this database and it's thrown away on crash anyway
+        self.__db.execute('PRAGMA synchronous = OFF')
+        self.__db.execute('PRAGMA journal_mode = OFF')
+        self.__db.execute('CREATE TABLE items (item BLOB PRIMARY KEY)')
+        self.__items, items = None, self.__items
+        self.update(items)
+
+    def add(self, item):
+        if self.__db is None:
+            self.__items.add(item)
+            if self.limit is not None and len(self.__items) > self.limit:
+                self.__spill()
+        else:
+            self.__db.execute('INSERT OR IGNORE INTO items VALUES (?)', (buffer(item), ))
+
+    def update(self, items):
+        if self.__db is None:
+            for item in items:
+                self.add(item)
+        else:
+            self.__db.executemany('INSERT OR IGNORE INTO items VALUES (?)',
+                                  ((buffer(item), ) for item in items))
+
+    def __contains__(self, item):
+        if self.__db is None:
+            return item in self.__items
+        return self.__db.execute('SELECT 1 FROM items WHERE item = ?',
+                                 (buffer(item), )).fetchone() is not None
+
+    def __len__(self):
+        if self.__db is None:
+            return len(self.__items)
+        return self.__db.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def __iter__(self):
+        if self.__db is None:
+            return iter(self.__items)
+        return (str(row[0]) for row in self.__db.execute('SELECT item FROM items'))
+
+    def close(self):
+        if self.__db is not None:
+            self.__db.close()
+            os.remove(self.__path)
+            self.__db = None
+        self.__items = set()
+
+class SpillList(object):
+    '''
+    Append-only list that writes its items to temporary file once it grows over the limit
+    '''
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.__items = []
+        self.__file = None
+        self.__count = 0
+
+    def append(self, item):
+        self.__count += 1
+        if self.__file is None:
+            self.__items.append(item)
+            if self.limit is None or len(self.__items) <= self.limit:
+                return
+            self.__file = tempfile.TemporaryFile(prefix='pyWinClobber_', suffix='.list')
+            items, self.__items = self.__items, []
+        else:
+            items = [item]
+        for item in items:
+            pickle.dump(item, self.__file, pickle.HIGHEST_PROTOCOL)
+
+    def __len__(self):
+        return self.__count
+
+    def __iter__(self):
+        if self.__file is None:
+            return iter(list(self.__items))
+        self.__file.flush()
+        return _iterPickled(self.__file, self.__count)
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        self.__items = []
+
+def _iterPickled(f, count):
+    '''
+    Reads count pickled items from the start of the file, keeps its position intact so that
+    appending can continue after iteration
+    '''
+    position = f.tell()
+    offset = 0
+    try:
+        for _ in xrange(count):
+            f.seek(offset)
+            item = pickle.load(f)
+            offset = f.tell()
+            yield item
+    finally:
+        f.seek(position)
+
+def parseMemoryLimit(value):
+    '''
+    Converts --memory-limit command line value, use it as argparse type
+    '''
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise argparse.ArgumentTypeError('memory limit must be a positive number of items, '
+                                         'got %r' % value)
+    return limit
+
+if __name__ == '__main__':
+    import sys
+    sys.stderr.write('This is helper module not intended for standalone run\n')
+    sys.exit(1)